@@ -0,0 +1,228 @@
+"""Load and benchmark suite for the v1 API.
+
+    python benchmarks/api.py --users 10 --posts 50 --images 3 --requests 200 --threads 4 -o before.json
+
+Seeds a file-backed SQLite database with N users, M posts each and K images
+per post, then drives the API through the Flask test client, in one thread
+or several. Prints throughput, p50/p95/p99 latency and SQL statements per
+request for every scenario as JSON, so runs can be diffed between revisions.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+
+from lreview import create_app, search
+from lreview.extensions import db
+from lreview.models import User, Post, Image, CurvePoint
+from lreview.setting import basedir, config
+
+
+PASSWORD = 'benchmark'
+SCENARIOS = ('register', 'token', 'user', 'posts_list', 'post_detail', 'curve', 'upload')
+
+
+class QueryCounter(object):
+    """Counts SQL statements issued by the current thread."""
+
+    def __init__(self, engine):
+        self._local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def reset(self):
+        self._local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=basedir,
+                                       stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_app(workdir):
+    images = os.path.join(workdir, 'images')
+    shutil.copytree(os.path.join(basedir, 'lreview/static/images/default'), os.path.join(images, 'default'))
+    config['benchmark'] = type('BenchmarkConfig', (config['testing'],), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'bench.db'),
+        'UPLOADED_PHOTOS_DEST': images
+    })
+    return create_app('benchmark')
+
+
+def seed(app, users, posts, images):
+    """Insert the data set directly, far faster than going through the API."""
+    with app.app_context():
+        db.create_all()
+        template = User(email='template@example.com', username='template', name='template', birthday='2000-01-01')
+        template.set_password(PASSWORD)
+        password_hash = template.password_hash
+
+        start = datetime.utcnow() - timedelta(days=posts)
+        for u in range(users):
+            user = User(email='user%d@example.com' % u, username='user%d' % u, name='user %d' % u,
+                        birthday='1990-01-01', password_hash=password_hash, posts_count=posts)
+            db.session.add(user)
+            for p in range(posts):
+                post = Post(title='post %d of user %d' % (p, u), body='body text ' * 40, happen_age=p % 60,
+                            introspection='introspection ' * 20, emotion=('happy', 'sad', 'angry')[p % 3],
+                            score=p % 10, timestamp=start + timedelta(days=p), user=user)
+                db.session.add(post)
+                post.add_images(['be/nc/%062x%02x.jpg' % (u * posts + p, i) for i in range(images)])
+                db.session.add(CurvePoint(post=post, user=user, title=post.title, happen_age=post.happen_age,
+                                          score=post.score, cover=post.cover_filename))
+            db.session.commit()
+        search.reindex()
+
+        directory = os.path.join(app.config['UPLOADED_PHOTOS_DEST'], 'be', 'nc')
+        os.makedirs(directory, exist_ok=True)
+        for (filename,) in db.session.query(Image.filename):
+            with open(os.path.join(app.config['UPLOADED_PHOTOS_DEST'], filename), 'wb') as f:
+                f.write(b'\xff\xd8benchmark\xff\xd9')
+        return [post_id for (post_id,) in db.session.query(Post.id).filter(Post.user_id == 1)]
+
+
+def login(client, username):
+    response = client.post('/api/v1/oauth/token', data=json.dumps(
+        {'grant_type': 'password', 'username': username, 'password': PASSWORD}))
+    return {'Authorization': 'Bearer ' + response.get_json()['access_token']}
+
+
+def scenario_request(name, client, headers, post_ids, images, serial):
+    if name == 'register':
+        return client.post('/api/v1/register', data=json.dumps({
+            'email': 'new%s@example.com' % serial, 'username': 'new%s' % serial,
+            'password': PASSWORD, 'name': 'new', 'birthday': '2000-01-01'}))
+    if name == 'token':
+        return client.post('/api/v1/oauth/token', data=json.dumps(
+            {'grant_type': 'password', 'username': 'user0', 'password': PASSWORD}))
+    if name == 'user':
+        return client.get('/api/v1/user', headers=headers)
+    if name == 'posts_list':
+        return client.get('/api/v1/user/posts', headers=headers)
+    if name == 'post_detail':
+        return client.get('/api/v1/user/post/%d' % post_ids[serial % len(post_ids)], headers=headers)
+    if name == 'curve':
+        return client.get('/api/v1/user/curve', headers=headers)
+    if name == 'upload':
+        files = [(io.BytesIO(b'\xff\xd8upload %s %d\xff\xd9' % (str(serial).encode('ascii'), i)), 'photo%d.jpg' % i)
+                 for i in range(images)]
+        return client.post('/api/v1/user/posts', headers=headers, content_type='multipart/form-data', data={
+            'title': 'upload %s' % serial, 'body': 'body', 'happen_age': '20', 'introspection': 'introspection',
+            'emotion': 'happy', 'score': '5', 'images': files})
+    raise ValueError(name)
+
+
+def run_scenario(app, counter, name, requests, threads, post_ids, images):
+    latencies = []
+    queries = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(index):
+        client = app.test_client()
+        headers = login(client, 'user0')
+        for n in range(index, requests, threads):
+            serial = '%s-%d' % (time.time(), n) if name == 'register' else n
+            counter.reset()
+            start = time.perf_counter()
+            response = scenario_request(name, client, headers, post_ids, images, serial)
+            # collection bodies are streamed, time them to the last byte and release the request
+            response.get_data()
+            response.close()
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                queries.append(counter.count)
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'queries_mean': round(sum(queries) / float(len(queries)), 2),
+        'queries_max': max(queries)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--posts', type=int, default=50, help='posts per user')
+    parser.add_argument('--images', type=int, default=3, help='images per post')
+    parser.add_argument('--requests', type=int, default=100, help='requests per scenario')
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('-o', '--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='lreview-bench-')
+    try:
+        app = make_app(workdir)
+        post_ids = seed(app, args.users, args.posts, args.images)
+        with app.app_context():
+            counter = QueryCounter(db.engine)
+        results = {}
+        for name in args.scenarios.split(','):
+            results[name] = run_scenario(app, counter, name, args.requests, args.threads, post_ids, args.images)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'revision': revision(),
+            'python': platform.python_version(),
+            'users': args.users,
+            'posts_per_user': args.posts,
+            'images_per_post': args.images,
+            'requests_per_scenario': args.requests,
+            'threads': args.threads
+        },
+        'results': results
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
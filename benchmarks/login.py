@@ -0,0 +1,108 @@
+"""Login throughput under concurrent load, hashing inline vs on the process pool.
+
+    python benchmarks/login.py --threads 8 --logins 200
+
+While the login burst runs, a bystander thread polls GET /api/v1/user with a
+cached token to show how much the hashing starves other requests.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lreview import create_app
+from lreview.extensions import db
+from lreview.models import User
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def run(workers, threads, logins, database):
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + database
+    app.config['PASSWORD_HASH_WORKERS'] = workers
+    app.config['PASSWORD_HASH_MAX_PENDING'] = max(threads, 1) * 2
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for i in range(threads):
+            user = User(email='user%d@example.com' % i, username='user%d' % i, name='user', birthday='2000-01-01')
+            user.set_password('password')
+            db.session.add(user)
+        db.session.commit()
+
+    client = app.test_client()
+    token = client.post('/api/v1/oauth/token', data=json.dumps(
+        {'grant_type': 'password', 'username': 'user0', 'password': 'password'})).get_json()['access_token']
+    headers = {'Authorization': 'Bearer ' + token}
+
+    statuses = {}
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def login(i):
+        c = app.test_client()
+        body = json.dumps({'grant_type': 'password', 'username': 'user%d' % i, 'password': 'password'})
+        for _ in range(logins // threads):
+            code = c.post('/api/v1/oauth/token', data=body).status_code
+            with lock:
+                statuses[code] = statuses.get(code, 0) + 1
+
+    bystander_latency = []
+
+    def bystander():
+        c = app.test_client()
+        while not done.is_set():
+            start = time.perf_counter()
+            c.get('/api/v1/user', headers=headers)
+            bystander_latency.append(time.perf_counter() - start)
+            time.sleep(0.005)
+
+    watcher = threading.Thread(target=bystander)
+    watcher.start()
+    pool = [threading.Thread(target=login, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    watcher.join()
+
+    total = sum(statuses.values())
+    return {
+        'workers': workers,
+        'logins': total,
+        'statuses': statuses,
+        'logins_per_second': round(total / elapsed, 1),
+        'bystander_p50_ms': round(percentile(bystander_latency, 50) * 1000, 2),
+        'bystander_p95_ms': round(percentile(bystander_latency, 95) * 1000, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    database = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    results = [run(0, args.threads, args.logins, database),
+               run(args.workers, args.threads, args.logins, database)]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Micro-benchmark of per-post serialization cost.
+
+    python benchmarks/serialize.py --posts 500 --images 3
+
+Compares the previous serializer, which built every URL through url_for()
+and photos.url(), with the prefix-based one in lreview.apis.v1.schemas.
+"""
+import argparse
+import functools
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import url_for, g
+
+from lreview import create_app
+from lreview.extensions import db, photos
+from lreview.models import User, Post, Image
+from lreview.apis.v1.schemas import post_schema, images_by_post, dumps
+
+
+https_url_for = functools.partial(url_for, _scheme='https')
+
+
+def legacy_post_schema(post, images):
+    return {
+        'kind': 'Post',
+        'id': post.id,
+        'self': https_url_for('.post', post_id=post.id, _external=True),
+        'title': post.title,
+        'body': post.body,
+        'happen_age': post.happen_age,
+        'introspection': post.introspection,
+        'emotion': post.emotion,
+        'score': post.score,
+        'user': {
+            'kind': 'User',
+            'id': post.user.id,
+            'url': https_url_for('.user', _external=True),
+            'username': post.user.username
+        },
+        'images': [photos.url(image.filename) for image in images] if images else [photos.url('default/defaultStory.png')]
+    }
+
+
+def seed(posts, images):
+    user = User(email='bench@example.com', username='bench', name='bench', birthday='2000-01-01')
+    user.set_password('bench')
+    db.session.add(user)
+    for i in range(posts):
+        post = Post(title='post %d' % i, body='body ' * 50, happen_age=i % 80, introspection='introspection ' * 20,
+                    emotion='happy', score=i % 10, user=user)
+        db.session.add(post)
+        for j in range(images):
+            db.session.add(Image(filename='ab/cd/%064x.jpg' % (i * images + j), post=post))
+    db.session.commit()
+    return user
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--posts', type=int, default=500)
+    parser.add_argument('--images', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        user = seed(args.posts, args.images)
+        posts = Post.query.with_parent(user).all()
+        images = images_by_post(posts)
+
+        with app.test_request_context('/api/v1/user/posts', base_url='https://localhost'):
+            def legacy():
+                return json.dumps([legacy_post_schema(post, images[post.id]) for post in posts]).encode('utf-8')
+
+            def compiled():
+                g.pop('schema_urls', None)  # resolve the URL prefixes once per run, as a request does
+                return dumps([post_schema(post, images[post.id]) for post in posts])
+
+            results = {}
+            for name, func in (('legacy', legacy), ('compiled', compiled)):
+                best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+                results[name] = best / len(posts) * 1e6
+            results['speedup'] = results['legacy'] / results['compiled']
+
+    print(json.dumps({
+        'posts': args.posts,
+        'images_per_post': args.images,
+        'legacy_us_per_post': round(results['legacy'], 2),
+        'compiled_us_per_post': round(results['compiled'], 2),
+        'speedup': round(results['speedup'], 2)
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 import os
+import time
 import click
 from flask import Flask, request
 from flask_uploads import configure_uploads, patch_request_class
@@ -6,7 +7,11 @@ from flask_uploads import configure_uploads, patch_request_class
 from lreview.setting import config
 from lreview.extensions import db, login_manager, migrate, mail, photos
 from lreview.apis.v1 import api_v1
+from lreview.media import media_bp
 from lreview.apis.v1.errors import api_abort
+from lreview.outbox import outbox
+from lreview.storage import file_reaper
+from lreview import metrics, admission
 
 
 # when use [flask run], it will automatically invoke the function named create_app() / make_app()
@@ -18,8 +23,11 @@ def create_app(config_name=None):
     app.config.from_object(config[config_name])
 
     register_extensions(app)
+    register_metrics(app)
+    register_admission(app)
     register_blueprints(app)
     register_errors(app)
+    register_commands(app)
     register_shell_context(app)
     register_template_context(app)
     return app
@@ -28,16 +36,40 @@ def create_app(config_name=None):
 def register_extensions(app):
     db.init_app(app)
     login_manager.init_app(app)
-    migrate.init_app(app, db)
+    migrate.init_app(app, db, render_as_batch=True)  # SQLite alters tables by copying them
     mail.init_app(app)
+    outbox.init_app(app)
+    file_reaper.init_app(app)
 
     # upload config
     configure_uploads(app, photos)
     patch_request_class(app)  # set maximum file size, default is 16MB
 
 
+def register_metrics(app):
+    registry = metrics.init_app(app).registry
+    dispatcher = app.extensions['outbox']
+    registry.register(metrics.Sampled(
+        'lreview_outbox_queue_depth', 'Outbox emails waiting to be sent.', 'gauge', dispatcher.queue_depth))
+    for collector in dispatcher.collectors():
+        registry.register(collector)
+    reaper = app.extensions['file_reaper']
+    registry.register(metrics.Sampled(
+        'lreview_file_tombstones', 'Files waiting for the reaper.', 'gauge', reaper.pending))
+    registry.register(reaper.removed)
+
+
+def register_admission(app):
+    # after the metrics hooks, so rejected requests are counted and timed too
+    controller = admission.init_app(app)
+    registry = app.extensions['metrics'].registry
+    for collector in controller.collectors():
+        registry.register(collector)
+
+
 def register_blueprints(app):
     app.register_blueprint(api_v1, url_prefix='/api/v1')
+    app.register_blueprint(media_bp, url_prefix='/media')
 
 
 def register_errors(app):
@@ -52,12 +84,123 @@ def register_errors(app):
         return api_abort(400, message='Server error.')
 
 
+def register_commands(app):
+    @app.cli.command('rebuild-curve')
+    @click.option('--batch-size', default=500, help='Posts to process per commit.')
+    def rebuild_curve(batch_size):
+        """Rebuild the life-curve projection of every post."""
+        from lreview.models import Post, CurvePoint
+        click.echo('Rebuilding curve points...')
+        last_id = 0
+        total = 0
+        while True:
+            posts = Post.query.filter(Post.id > last_id).order_by(Post.id).limit(batch_size).all()
+            if not posts:
+                break
+            for post in posts:
+                CurvePoint.sync(post)
+            db.session.commit()
+            last_id = posts[-1].id
+            total += len(posts)
+        click.echo('Done, %d posts processed.' % total)
+
+
+    @app.cli.command('backfill-counters')
+    def backfill_counters():
+        """Recompute posts_count, image_count and cover_filename from the rows they summarize."""
+        from lreview import counters
+        click.echo('Backfilling counters...')
+        counters.backfill()
+        click.echo('Done.')
+
+    @app.cli.command('check-counters')
+    @click.option('--limit', default=100, help='Mismatches to list per column.')
+    def check_counters(limit):
+        """Compare the denormalized counters with the rows they summarize, exit with 1 on drift."""
+        from lreview import counters
+        found = counters.mismatches(limit)
+        for table, key, column, stored, actual in found:
+            click.echo('%s %d: %s is %r, should be %r' % (table, key, column, stored, actual))
+        if found:
+            click.echo('%d mismatches, run `flask backfill-counters` to repair.' % len(found))
+            raise SystemExit(1)
+        click.echo('All counters consistent.')
+
+    @app.cli.command('reindex-posts')
+    def reindex_posts():
+        """Rebuild the full-text search index of posts."""
+        from lreview import search
+        click.echo('Reindexing posts...')
+        count = search.reindex()
+        tokenizer = search.tokenizer()
+        if tokenizer is None:
+            click.echo('No FTS5 support on this database, search falls back to LIKE.')
+        else:
+            click.echo('Done, %d posts indexed with the %s tokenizer.' % (count, tokenizer))
+
+    @app.cli.command('reap-files')
+    def reap_files():
+        """Unlink the files of deleted posts and replaced avatars that are due."""
+        reaper = app.extensions['file_reaper']
+        total = 0
+        while True:
+            settled = reaper.run_once()
+            if not settled:
+                break
+            total += settled
+        click.echo('%d tombstones settled, %d pending.' % (total, reaper.pending()))
+
+    @app.cli.command('reconcile-photos')
+    @click.option('--batch-size', default=500, help='Files to check per query.')
+    @click.option('--dry-run', is_flag=True, help='Only list the orphans.')
+    def reconcile_photos(batch_size, dry_run):
+        """Remove stored files that no image or avatar refers to."""
+        from lreview import storage
+        scanned = removed = 0
+        for count, orphans in storage.reconcile(batch_size, app.config['FILE_REAPER_GRACE'], dry_run):
+            scanned += count
+            removed += len(orphans)
+            for name in orphans:
+                click.echo(('Orphan: %s' if dry_run else 'Removed: %s') % name)
+        click.echo('%d files scanned, %d orphans%s.' % (scanned, removed, '' if dry_run else ' removed'))
+
+    @app.cli.command('prune-sync')
+    @click.option('--days', default=None, type=int, help='Keep tombstones this recent, defaults to the config.')
+    def prune_sync(days):
+        """Drop old delta-sync tombstones, older sync tokens must resync from scratch."""
+        from datetime import datetime, timedelta
+        from lreview import sync
+        if days is None:
+            days = app.config['LREVIEW_SYNC_TOMBSTONE_DAYS']
+        removed = sync.prune(datetime.utcnow() - timedelta(days=days))
+        click.echo('%d tombstones pruned.' % removed)
+
+    @app.cli.command('send-outbox')
+    @click.option('--once', is_flag=True, help='Send what is due and exit.')
+    def send_outbox(once):
+        """Run the email outbox dispatcher in the foreground."""
+        dispatcher = app.extensions['outbox']
+        if once:
+            click.echo('%d emails claimed.' % dispatcher.dispatch())
+            click.echo(dispatcher.metrics())
+            return
+        click.echo('Dispatching outbox, press Ctrl+C to stop.')
+        dispatcher.start()
+        try:
+            while True:
+                time.sleep(app.config['MAIL_OUTBOX_POLL_INTERVAL'])
+                click.echo(dispatcher.metrics())
+        except KeyboardInterrupt:
+            dispatcher.stop()
+
+
 # when use [flask shell], it will invoke the function and register the items
 def register_shell_context(app):
     @app.shell_context_processor
     def make_shell_context():
-        from lreview.models import User, Post, Image
-        return dict(db=db, User=User, Post=Post, Image=Image)
+        from lreview.models import User, Post, Image, CurvePoint, OutboxEmail, FileTombstone, SyncTombstone
+        return dict(db=db, User=User, Post=Post, Image=Image, CurvePoint=CurvePoint, OutboxEmail=OutboxEmail,
+                    FileTombstone=FileTombstone, SyncTombstone=SyncTombstone)
 
 
 def register_template_context(app):
@@ -0,0 +1,152 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, request
+from werkzeug.utils import import_string
+
+from lreview.metrics import Counter, Gauge
+from lreview.apis.v1.auth import BATCH_ITEM, get_token, validate_token
+from lreview.apis.v1.errors import service_unavailable, too_many_requests
+
+
+class LocalBuckets(object):
+    """Token buckets kept in process memory, the default store.
+
+    A store has one method, take(key, rate, capacity), which takes a token
+    from the bucket at key and returns 0, or returns the seconds until a
+    token will be there. Point ADMISSION_STORE at another class taking the
+    app, e.g. one on Redis, to share buckets between processes.
+    """
+
+    def __init__(self, app):
+        self.maxsize = app.config['ADMISSION_BUCKETS_SIZE']
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, capacity):
+        now = time.monotonic()
+        with self._lock:
+            tokens, stamp = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - stamp) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.maxsize:
+                # the bucket idle the longest, refilled by now more often than not
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class Admission(object):
+    """Turns requests to expensive endpoints away before their body is read.
+
+    ADMISSION_LIMITS maps (endpoint, method) to a concurrency limit per
+    process and to request rates per user and per client IP.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.limits = app.config['ADMISSION_LIMITS']
+        store = app.config['ADMISSION_STORE']
+        self.store = import_string(store)(app) if store else LocalBuckets(app)
+        self.slots = {key: threading.BoundedSemaphore(limit['concurrency'])
+                      for key, limit in self.limits.items() if limit.get('concurrency')}
+        self._running = {}
+        self._lock = threading.Lock()
+        labels = ('endpoint', 'method')
+        self.admitted = Counter('lreview_admission_admitted_total', 'Requests let through admission control.', labels)
+        self.rejected = Counter('lreview_admission_rejected_total', 'Requests turned away by admission control.',
+                                labels + ('reason',))
+        self.in_flight = Gauge('lreview_admission_in_flight', 'Admitted requests running per limited endpoint.', labels)
+
+    def collectors(self):
+        return self.admitted, self.rejected, self.in_flight
+
+    def _user_id(self):
+        if request.environ.get(BATCH_ITEM) and 'current_user' in g:
+            # a sub-request of /batch, which authenticated already
+            return g.current_user.id
+        token_type, token = get_token()
+        if token_type is None or token_type.lower() != 'bearer' or token is None:
+            return None
+        # cached after the first request, and auth_required finds it cached again
+        if not validate_token(token):
+            return None
+        return g.current_user.id
+
+    def _wait(self, key, scope, client, per_minute):
+        if per_minute is None or client is None:
+            return 0
+        return self.store.take('%s:%s:%s:%s' % (key + (scope, client)), per_minute / 60.0, per_minute)
+
+    def _occupy(self, key, delta):
+        with self._lock:
+            running = self._running[key] = self._running.get(key, 0) + delta
+            self.in_flight.set(running, *key)
+
+    def admit(self):
+        """Charge the current request to the limits of its endpoint.
+
+        Returns (rejection, slot): a 429 or 503 response to send instead, or
+        the concurrency slot taken, to hand back to release() when done.
+        """
+        if not self.app.config['ADMISSION_ENABLED']:
+            return None, None
+        key = (request.endpoint, request.method)
+        limit = self.limits.get(key)
+        if limit is None:
+            return None, None
+
+        wait = self._wait(key, 'ip', request.remote_addr, limit.get('per_ip'))
+        if wait:
+            self.rejected.inc(*(key + ('ip',)))
+            return too_many_requests(int(math.ceil(wait))), None
+        if limit.get('per_user') is not None:
+            wait = self._wait(key, 'user', self._user_id(), limit['per_user'])
+            if wait:
+                self.rejected.inc(*(key + ('user',)))
+                return too_many_requests(int(math.ceil(wait))), None
+
+        slot = None
+        semaphore = self.slots.get(key)
+        if semaphore is not None:
+            if not semaphore.acquire(timeout=self.app.config['ADMISSION_QUEUE_TIMEOUT']):
+                self.rejected.inc(*(key + ('concurrency',)))
+                return service_unavailable(1), None
+            slot = (key, semaphore)
+            self._occupy(key, 1)
+        self.admitted.inc(*key)
+        return None, slot
+
+    def release(self, slot):
+        if slot is not None:
+            key, semaphore = slot
+            semaphore.release()
+            self._occupy(key, -1)
+
+    def before_request(self):
+        if request.environ.get(BATCH_ITEM):
+            # /batch admits its sub-requests one by one
+            return None
+        rejection, slot = self.admit()
+        if slot is not None:
+            g.admission_slot = slot
+        return rejection
+
+    def teardown_request(self, exc):
+        if request.environ.get(BATCH_ITEM):
+            # sub-requests of /batch share g with the batch itself
+            return
+        self.release(g.pop('admission_slot', None))
+
+
+def init_app(app):
+    admission = app.extensions['admission'] = Admission(app)
+    app.before_request(admission.before_request)
+    app.teardown_request(admission.teardown_request)
+    return admission
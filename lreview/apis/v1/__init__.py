@@ -4,4 +4,4 @@ from flask_cors import CORS
 api_v1 = Blueprint('api_v1', __name__)
 CORS(api_v1)
 
-from lreview.apis.v1 import resource
+from lreview.apis.v1 import resource, batch
@@ -2,33 +2,98 @@ from functools import wraps
 
 from flask import g, current_app, request
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer, BadSignature, SignatureExpired
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
 
 from lreview.apis.v1.errors import api_abort, invalid_token, token_missing
+from lreview.cache import TTLCache
+from lreview.extensions import db
+from lreview.metrics import BATCH_ITEM
 from lreview.models import User
 
 
 def forget_token(user):
     expiration = 60 * 60
     s = Serializer(current_app.config['SECRET_KEY'], expires_in=expiration)
-    token = s.dumps({'id': user.id}).decode('ascii')
+    token = s.dumps({'id': user.id, 'gen': user.token_generation or 0}).decode('ascii')
     return token, expiration
 
 
 def generate_token(user):
     expiration = 60 * 60 * 24 * 30
     s = Serializer(current_app.config['SECRET_KEY'], expires_in=expiration)
-    token = s.dumps({'id': user.id}).decode('ascii')
+    token = s.dumps({'id': user.id, 'gen': user.token_generation or 0}).decode('ascii')
     return token, expiration
 
 
+class TokenCache(object):
+    """Per-process cache of verified tokens and of the users they belong to.
+
+    Tokens map to (user id, token generation) until the expiry stamped in the
+    token itself. Users are kept as column snapshots for a short TTL, so a hit
+    on both costs neither an HMAC check nor a database round trip.
+    """
+
+    def __init__(self, size, user_ttl):
+        self.tokens = TTLCache(maxsize=size)
+        self.users = TTLCache(maxsize=size, ttl=user_ttl)
+
+    def load_user(self, user_id):
+        state = self.users.get(user_id)
+        if state is None:
+            user = User.query.get(user_id)
+            if user is not None:
+                self.remember(user)
+            return user
+        user = User(**state)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    def remember(self, user):
+        self.users.set(user.id, {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs})
+
+
+def token_cache():
+    cache = current_app.extensions.get('lreview_token_cache')
+    if cache is None:
+        cache = current_app.extensions['lreview_token_cache'] = TokenCache(
+            current_app.config['TOKEN_CACHE_SIZE'], current_app.config['TOKEN_CACHE_USER_TTL'])
+    return cache
+
+
+def forget_user(user):
+    """Drop the cached snapshot of a user, call it after committing changes to the user."""
+    token_cache().users.pop(user.id)
+
+
+def revoke_tokens(user):
+    """Invalidate every token issued to the user so far, call forget_user() after committing.
+
+    The increment runs in SQL, the cached user may hold a generation that is
+    already stale.
+    """
+    user.token_generation = User.token_generation + 1
+
+
 def validate_token(token):
-    s = Serializer(current_app.config['SECRET_KEY'])
-    try:
-        data = s.loads(token)
-    except (BadSignature, SignatureExpired):
-        return False
-    user = User.query.get(data['id'])
-    if user is None:
+    cache = token_cache()
+    entry = cache.tokens.get(token)
+    if entry is None:
+        s = Serializer(current_app.config['SECRET_KEY'])
+        try:
+            data, header = s.loads(token, return_header=True)
+        except (BadSignature, SignatureExpired):
+            return False
+        entry = (data['id'], data.get('gen', 0))
+        cache.tokens.set(token, entry, expires_at=header['exp'])
+
+    user_id, generation = entry
+    user = cache.load_user(user_id)
+    if user is not None and (user.token_generation or 0) < generation:
+        # issued after another process revoked, the cached snapshot is older than the token
+        db.session.refresh(user)
+        cache.remember(user)
+    if user is None or (user.token_generation or 0) != generation:
         return False
     g.current_user = user
     return True
@@ -51,6 +116,9 @@ def get_token():
 def auth_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
+        if request.environ.get(BATCH_ITEM) and 'current_user' in g:
+            # a sub-request of /batch, which authenticated already
+            return f(*args, **kwargs)
         token_type, token = get_token()
 
         if request.method != 'OPTIONS':
@@ -0,0 +1,106 @@
+import json
+import logging
+
+from flask import request, current_app
+from flask.views import MethodView
+from werkzeug.exceptions import HTTPException
+
+from lreview.extensions import db
+from lreview.apis.v1 import api_v1
+from lreview.apis.v1.auth import auth_required, BATCH_ITEM
+from lreview.apis.v1.errors import api_abort, ValidationError
+from lreview.apis.v1.schemas import dumps
+
+
+logger = logging.getLogger(__name__)
+
+METHODS = ('GET', 'POST', 'PUT', 'DELETE')
+# streamed bodies cannot be carried inside a JSON envelope
+EXCLUDED_ENDPOINTS = ('api_v1.batch', 'api_v1.export', 'api_v1.import')
+RESPONSE_HEADERS = ('ETag', 'Last-Modified', 'Location', 'Retry-After')
+# the batch authenticates once, and bodies are spliced into its JSON so they must stay uncompressed
+DROPPED_HEADERS = ('authorization', 'accept-encoding')
+
+
+def _parse(datas):
+    if not isinstance(datas, dict) or not isinstance(datas.get('requests'), list):
+        raise ValidationError('requests must be a list.')
+    items = datas['requests']
+    limit = current_app.config['LREVIEW_BATCH_MAX_REQUESTS']
+    if len(items) > limit:
+        raise ValidationError('At most %d requests per batch.' % limit)
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get('path'), str):
+            raise ValidationError('Each request needs a path.')
+        if item.get('method', 'GET') not in METHODS:
+            raise ValidationError('Method must be one of %s.' % ', '.join(METHODS))
+        if not isinstance(item.get('headers', {}), dict):
+            raise ValidationError('headers must be an object.')
+    return items
+
+
+def _dispatch():
+    """Run the view of the current sub-request like Flask would, minus the request hooks."""
+    if request.routing_exception is not None:
+        return api_abort(request.routing_exception.code)
+    if request.url_rule.endpoint in EXCLUDED_ENDPOINTS or not request.url_rule.endpoint.startswith('api_v1.'):
+        return api_abort(400, message='Not available in a batch.')
+    try:
+        return current_app.view_functions[request.url_rule.endpoint](**request.view_args)
+    except HTTPException as e:
+        return api_abort(e.code)
+    except Exception as e:
+        try:
+            # the blueprint error handlers, e.g. for ValidationError
+            return current_app.handle_user_exception(e)
+        except Exception:
+            logger.exception('Batch item %s %s failed.', request.method, request.path)
+            db.session.rollback()
+            return api_abort(500, message='Server error.')
+
+
+def _run(item):
+    body = item.get('body')
+    headers = {name: value for name, value in item.get('headers', {}).items() if name.lower() not in DROPPED_HEADERS}
+    with current_app.test_request_context(
+            item['path'], base_url=request.url_root, method=item.get('method', 'GET'),
+            data=json.dumps(body) if body is not None else None, content_type='application/json',
+            headers=headers, environ_overrides={BATCH_ITEM: True, 'REMOTE_ADDR': request.remote_addr}):
+        # each item is charged to the rate and concurrency limits of its own endpoint
+        admission = current_app.extensions['admission']
+        rejection, slot = admission.admit()
+        try:
+            response = current_app.make_response(rejection if rejection is not None else _dispatch())
+            data = response.get_data()
+        finally:
+            admission.release(slot)
+
+    envelope = {'status': response.status_code,
+                'headers': {name: response.headers[name] for name in RESPONSE_HEADERS if name in response.headers}}
+    if not data:
+        raw = b'null'
+    elif response.is_json:
+        # already encoded, spliced in as is
+        raw = data
+    else:
+        raw = dumps(data.decode('utf-8', 'replace'))
+    return dumps(envelope)[:-1] + b',"body":' + raw + b'}'
+
+
+class BatchAPI(MethodView):
+    decorators = [auth_required]
+
+    def post(self):
+        """Run several API requests with one round trip and one authentication."""
+        try:
+            datas = json.loads(request.get_data())
+        except ValueError:
+            raise ValidationError('Invalid JSON.')
+        items = _parse(datas)
+        # sub-requests share g, hence g.current_user, and the database session of this request
+        responses = [_run(item) for item in items]
+        body = b'{"kind":"BatchResult","responses":[' + b','.join(responses) + b'],"status_code":0}'
+        return current_app.response_class(body, mimetype='application/json')
+
+
+api_v1.add_url_rule('/batch', view_func=BatchAPI.as_view('batch'), methods=['POST'])
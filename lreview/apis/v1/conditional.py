@@ -0,0 +1,37 @@
+import hashlib
+from datetime import timezone
+
+from flask import current_app, request
+
+
+def make_etag(*parts):
+    return hashlib.sha1(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def _naive_utc(value):
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def add_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # clients may keep the payload but have to revalidate it
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def not_modified(etag, last_modified=None):
+    """Return a 304 response when the request validators still match, else None."""
+    if request.if_none_match:
+        matched = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since is not None and last_modified is not None:
+        matched = last_modified.replace(microsecond=0) <= _naive_utc(request.if_modified_since)
+    else:
+        matched = False
+
+    if not matched:
+        return None
+    return add_validators(current_app.response_class(status=304), etag, last_modified)
@@ -2,6 +2,7 @@ from flask import jsonify
 from werkzeug.http import HTTP_STATUS_CODES
 
 from lreview.apis.v1 import api_v1
+from lreview.hashing import HashingBusy
 
 
 def api_abort(code, message=None, **kwargs):
@@ -29,6 +30,18 @@ def token_missing():
     return response
 
 
+def service_unavailable(retry_after, message='Server busy, try again later.'):
+    response = api_abort(503, message=message, status_code=-1)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def too_many_requests(retry_after, message='Too many requests, try again later.'):
+    response = api_abort(429, message=message, status_code=-1)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
 class ValidationError(ValueError):
     pass
 
@@ -36,3 +49,8 @@ class ValidationError(ValueError):
 @api_v1.errorhandler(ValidationError)
 def validation_error(e):
     return api_abort(400, e.args[0])
+
+
+@api_v1.errorhandler(HashingBusy)
+def hashing_busy(e):
+    return service_unavailable(1)
@@ -0,0 +1,55 @@
+from flask import request
+from sqlalchemy.orm import load_only
+
+from lreview.apis.v1.errors import ValidationError
+
+
+POST_FIELDS = ('id', 'self', 'title', 'body', 'happen_age', 'introspection', 'emotion', 'score', 'user',
+               'images', 'thumbnails')
+CURVE_FIELDS = ('title', 'happen_age', 'score', 'cover', 'cover_thumbnail')
+IMAGE_FIELDS = frozenset(('images', 'thumbnails'))
+
+# columns each field reads, on top of the ones always needed for urls, cursors and ownership
+POST_COLUMNS = {'title': ('title',), 'body': ('body',), 'happen_age': ('happen_age',),
+                'introspection': ('introspection',), 'emotion': ('emotion',), 'score': ('score',),
+                'images': ('image_count',), 'thumbnails': ('image_count',)}
+POST_ALWAYS = ('id', 'timestamp', 'user_id')
+CURVE_COLUMNS = {'title': ('title',), 'happen_age': ('happen_age',), 'score': ('score',),
+                 'cover': ('cover',), 'cover_thumbnail': ('cover',)}
+CURVE_ALWAYS = ('id', 'post_id')
+
+
+def requested_fields(allowed):
+    """Return the fields named by ?fields= in the order of allowed, None to return them all."""
+    value = request.args.get('fields')
+    if value is None:
+        return None
+    names = set(name.strip() for name in value.split(',') if name.strip())
+    unknown = names.difference(allowed)
+    if unknown:
+        raise ValidationError('Unknown field %s.' % ', '.join(sorted(unknown)))
+    if not names:
+        raise ValidationError('No field requested.')
+    return tuple(name for name in allowed if name in names)
+
+
+def _load_only(fields, columns, always):
+    if fields is None:
+        return []
+    names = set(always)
+    for field in fields:
+        names.update(columns.get(field, ()))
+    return [load_only(*sorted(names))]
+
+
+def post_options(fields):
+    """Query options that leave the columns of unrequested post fields unloaded."""
+    return _load_only(fields, POST_COLUMNS, POST_ALWAYS)
+
+
+def curve_options(fields):
+    return _load_only(fields, CURVE_COLUMNS, CURVE_ALWAYS)
+
+
+def wants_images(fields):
+    return fields is None or not IMAGE_FIELDS.isdisjoint(fields)
@@ -0,0 +1,98 @@
+import json
+import os
+import re
+from datetime import datetime
+
+from lreview.extensions import photos
+from lreview.apis.v1.errors import ValidationError
+
+
+TIMESTAMP_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+FILENAME_RE = re.compile(r'^[0-9a-zA-Z_\-]+(/[0-9a-zA-Z_\-]+)*\.[0-9a-zA-Z]+$')
+TEXT_LIMITS = {'title': 64, 'emotion': 64, 'body': None, 'introspection': None}
+
+
+def export_record(post, images):
+    return {
+        'id': post.id,
+        'title': post.title,
+        'body': post.body,
+        'happen_age': post.happen_age,
+        'introspection': post.introspection,
+        'emotion': post.emotion,
+        'score': post.score,
+        'timestamp': post.timestamp.isoformat() if post.timestamp else None,
+        'images': [image.filename for image in images]
+    }
+
+
+def _int(data, key):
+    value = data.get(key)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValidationError('%s must be an integer.' % key)
+    return value
+
+
+def _timestamp(value):
+    if value is None:
+        return datetime.utcnow()
+    if not isinstance(value, str):
+        raise ValidationError('timestamp must be an ISO 8601 string.')
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValidationError('timestamp must be an ISO 8601 string.')
+
+
+def parse_record(line):
+    """Parse one NDJSON line into Post fields and image filenames, raise ValidationError if invalid."""
+    try:
+        data = json.loads(line.decode('utf-8'))
+    except (UnicodeDecodeError, ValueError):
+        raise ValidationError('Invalid JSON.')
+    if not isinstance(data, dict):
+        raise ValidationError('Each line must be a JSON object.')
+
+    fields = {}
+    for key, limit in TEXT_LIMITS.items():
+        value = data.get(key)
+        if value is not None and not isinstance(value, str):
+            raise ValidationError('%s must be a string.' % key)
+        if value is not None and limit is not None and len(value) > limit:
+            raise ValidationError('%s is longer than %d characters.' % (key, limit))
+        fields[key] = value
+    fields['happen_age'] = _int(data, 'happen_age')
+    fields['score'] = _int(data, 'score')
+    fields['timestamp'] = _timestamp(data.get('timestamp'))
+
+    images = data.get('images') or []
+    if not isinstance(images, list):
+        raise ValidationError('images must be a list of filenames.')
+    for filename in images:
+        # only files already in storage can be referenced, e.g. from an export of this server
+        if not isinstance(filename, str) or not FILENAME_RE.match(filename) or \
+                not os.path.isfile(photos.path(filename)):
+            raise ValidationError('Unknown image %r.' % (filename,))
+    return fields, images
+
+
+def read_lines(stream, max_length):
+    """Yield (line number, line) from a stream without reading it whole, None for overlong lines."""
+    number = 0
+    while True:
+        line = stream.readline(max_length + 1)
+        if not line:
+            return
+        number += 1
+        if len(line) > max_length and not line.endswith(b'\n'):
+            # drain the rest of the overlong line
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(max_length)
+            yield number, None
+            continue
+        if line.strip():
+            yield number, line
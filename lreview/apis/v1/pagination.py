@@ -0,0 +1,61 @@
+import base64
+import binascii
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+from lreview.models import Post
+from lreview.apis.v1.errors import ValidationError
+
+
+CURSOR_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(post, direction):
+    raw = '%s|%s|%d' % (direction, post.timestamp.strftime(CURSOR_TIME_FORMAT), post.id)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        direction, timestamp, post_id = raw.split('|')
+        if direction not in ('next', 'prev'):
+            raise ValueError(direction)
+        return direction, datetime.strptime(timestamp, CURSOR_TIME_FORMAT), int(post_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValidationError('Invalid cursor.')
+
+
+def keyset_page(query, cursor, limit):
+    """Return (posts, prev_cursor, next_cursor) ordered by (timestamp, id), newest first."""
+    if cursor is None:
+        direction = 'next'
+    else:
+        direction, timestamp, post_id = decode_cursor(cursor)
+        if direction == 'next':
+            query = query.filter(or_(Post.timestamp < timestamp,
+                                     and_(Post.timestamp == timestamp, Post.id < post_id)))
+        else:
+            query = query.filter(or_(Post.timestamp > timestamp,
+                                     and_(Post.timestamp == timestamp, Post.id > post_id)))
+
+    if direction == 'next':
+        query = query.order_by(Post.timestamp.desc(), Post.id.desc())
+    else:
+        query = query.order_by(Post.timestamp.asc(), Post.id.asc())
+
+    # fetch one extra row to know whether there is another page in this direction
+    posts = query.limit(limit + 1).all()
+    has_more = len(posts) > limit
+    posts = posts[:limit]
+
+    if direction == 'prev':
+        posts.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = cursor is not None, has_more
+
+    prev_cursor = encode_cursor(posts[0], 'prev') if posts and has_prev else None
+    next_cursor = encode_cursor(posts[-1], 'next') if posts and has_next else None
+    return posts, prev_cursor, next_cursor
@@ -1,22 +1,42 @@
-from flask import request, jsonify, Blueprint, g, url_for
-from flask_mail import Message
+from flask import request, jsonify, Blueprint, g, url_for, current_app, stream_with_context
 from flask.views import MethodView
-from lreview.models import User, Post, Image
-from lreview.extensions import db, mail, photos
+from lreview.models import User, Post, CurvePoint
+from lreview.extensions import db
+from lreview.database import read_only
+from lreview.outbox import outbox
+from lreview import storage, search, stats, sync
+from lreview.hashing import needs_rehash
 from lreview.apis.v1 import api_v1
 from lreview.apis.v1.errors import api_abort, ValidationError
-from lreview.apis.v1.auth import auth_required, generate_token, forget_token
-from lreview.apis.v1.schemas import user_schema, post_schema, posts_schema, curve_schema
-import os
+from lreview.apis.v1.auth import auth_required, generate_token, forget_token, forget_user, revoke_tokens
+from lreview.apis.v1.schemas import user_schema, post_schema, posts_schema, curve_schema, curve_point_schema, images_by_post, json_response, urls, dumps
+from lreview.apis.v1.ndjson import export_record, parse_record, read_lines
+from lreview.apis.v1.pagination import keyset_page
+from lreview.apis.v1.conditional import make_etag, not_modified, add_validators
+from lreview.apis.v1.streaming import json_chunks, streamed_response
+from lreview.apis.v1.fields import POST_FIELDS, CURVE_FIELDS, requested_fields, post_options, curve_options, wants_images
 import json
-import hashlib
-import time
 import functools
 
 
 url_for = functools.partial(url_for, _scheme='https')
 
 
+def user_meta(user):
+    """Read the version, updated_at and posts_count of a user from the database.
+
+    g.current_user may be a snapshot cached by another request, up to
+    TOKEN_CACHE_USER_TTL old when another process changed the user.
+    """
+    return db.session.query(User.version, User.updated_at, User.posts_count).filter(User.id == user.id).one()
+
+
+def posts_changed(user):
+    """Drop what is cached about the posts of a user, call it after committing post changes."""
+    forget_user(user)
+    stats.invalidate(user)
+
+
 class Register(MethodView):
     def post(self):
         data = json.loads(request.get_data())
@@ -49,7 +69,7 @@ class Forget(MethodView):
         user = User.query.filter_by(email=email).first()
         token, expiration = forget_token(user)
 
-        msg = Message(
+        outbox.enqueue(
             subject='重設密碼',
             recipients=[email],
             html='<p>哈囉 %s :</p> \
@@ -57,7 +77,8 @@ class Forget(MethodView):
                 <b>%s</b> \
                 <p>請於一小時內完成密碼重置</p>' % (user.username, token)
         )
-        mail.send(msg)
+        db.session.commit()
+        outbox.notify()
         return jsonify({'message': 'Token has been sent.', 'status_code': 0}), 200
 
 
@@ -68,8 +89,12 @@ class Reset(MethodView):
         data = json.loads(request.get_data())
         password = data['password']
         user = g.current_user
+        # g.current_user may be a cached snapshot, write over what the database holds
+        db.session.refresh(user)
         user.set_password(password)
+        revoke_tokens(user)
         db.session.commit()
+        forget_user(user)
         return jsonify({'message': 'Modified.', 'status_code': 0}), 200
 
 
@@ -86,6 +111,9 @@ class AuthTokenAPI(MethodView):
         user = User.query.filter_by(username=username).first()
         if user is None or not user.validate_password(password):
             return api_abort(code=400, message='Username or password was invalid.', status_code=2)
+        if needs_rehash(user.password_hash):
+            user.set_password(password)
+            db.session.commit()
 
         token, expiration = generate_token(user)
 
@@ -103,11 +131,18 @@ class AuthTokenAPI(MethodView):
 class UserAPI(MethodView):
     decorators = [auth_required]
 
+    @read_only
     def get(self):
         user = g.current_user
+        # the body and the validators from one read, of the replica when there is one
+        db.session.refresh(user)
+        etag = make_etag('user', user.id, user.version)
+        response = not_modified(etag, user.updated_at)
+        if response is not None:
+            return response
         datas = user_schema(user)
         datas['status_code'] = 0
-        return jsonify(datas)
+        return add_validators(json_response(datas), etag, user.updated_at)
 
     def put(self):
         data = json.loads(request.get_data())
@@ -116,13 +151,16 @@ class UserAPI(MethodView):
         birthday = data['birthday']
         
         user = g.current_user
+        db.session.refresh(user)
         if email != user.email and User.query.filter_by(email=email).first() is not None:
             return api_abort(400, message='Existing email.', status_code=-1) 
 
         user.email = email
         user.name = name
         user.birthday = birthday
+        user.touch()
         db.session.commit()
+        forget_user(user)
         return jsonify({'message': 'Modified.', 'status_code': 0}), 200
 
 
@@ -132,20 +170,21 @@ class Avatar(MethodView):
     def put(self):
         try:
             user = g.current_user
-            filename = request.files.getlist('avatar')[0]
-            name = hashlib.md5((user.username + str(time.time())).encode('UTF-8'))
-            name = name.hexdigest()[:15]
-            filename = photos.save(filename, name=name + '.')
-
-            if user.avatar != 'default/defaultAvatar.png':
-                path = photos.path(user.avatar)
-                os.remove(path)
-
-            user.avatar = filename
-            db.session.commit()
+            # the avatar to bury is the one in the database, not the one cached
+            db.session.refresh(user)
+            staged = storage.stage(request.files.getlist('avatar')[0])
+
+            old_avatar = user.avatar
+            with storage.committing([staged]) as filenames:
+                filename = user.avatar = filenames[0]
+                if old_avatar != filename:
+                    storage.bury(old_avatar)
+                user.touch()
+            forget_user(user)
+            storage.file_reaper.notify()
         except:
             return api_abort(401, message='Avatar missing.', status_code=-1)
-        return jsonify({'message': 'Uploaded.', 'avatar_url': photos.url(filename), 'status_code': 0}), 200 
+        return jsonify({'message': 'Uploaded.', 'avatar_url': urls().photo(filename), 'status_code': 0}), 200 
 
 
 class PostAPI(MethodView):
@@ -153,12 +192,19 @@ class PostAPI(MethodView):
 
     def get(self, post_id):
         """Get post."""
-        post = Post.query.get_or_404(post_id)
-        if g.current_user != post.user:
+        meta = db.session.query(Post.user_id, Post.version, Post.updated_at).filter(Post.id == post_id).first_or_404()
+        if g.current_user.id != meta.user_id:
             return api_abort(403, message='Do not touch me!!', status_code=-1)
-        datas = post_schema(post)
+        fields = requested_fields(POST_FIELDS)
+        etag = make_etag('post', post_id, meta.version, fields)
+        response = not_modified(etag, meta.updated_at)
+        if response is not None:
+            return response
+
+        post = Post.query.options(*post_options(fields)).get_or_404(post_id)
+        datas = post_schema(post, fields=fields)
         datas['status_code'] = 0
-        return jsonify(datas)
+        return add_validators(json_response(datas), etag, meta.updated_at)
 
     def put(self, post_id):
         """Edit post."""
@@ -173,60 +219,70 @@ class PostAPI(MethodView):
         introspection = request.form.get('introspection')
         emotion = request.form.get('emotion')
         score = request.form.get('score')
-        
-        post.title = title
-        post.body = body
-        post.happen_age = happen_age
-        post.introspection = introspection
-        post.emotion = emotion
-        post.score = score
-        db.session.commit()
-
-        if request.files.getlist('images'):
-            for filename in request.files.getlist('images'):
-                name = hashlib.md5((user.username + str(time.time())).encode('UTF-8'))
-                name = name.hexdigest()[:15]
-                filename = photos.save(filename, name=name + '.')
-
-                image = Image(filename=filename, post=post)
-                db.session.add(image)
-                db.session.commit()
+        staged = storage.stage_all(request.files.getlist('images'))
+
+        with storage.committing(staged) as filenames:
+            post.title = title
+            post.body = body
+            post.happen_age = happen_age
+            post.introspection = introspection
+            post.emotion = emotion
+            post.score = score
+            post.add_images(filenames)
+            CurvePoint.sync(post)
+            search.index_post(post)
+            post.touch()
+            post.change_seq = user.next_change()
+        posts_changed(user)
         return jsonify({'message': 'Modified.', 'status_code': 0}), 200
 
     def delete(self, post_id):
         """Delete post."""
+        user = g.current_user
         post = Post.query.get_or_404(post_id)
-        if g.current_user != post.user:
+        if user != post.user:
             return api_abort(403, message='Do not touch me!!', status_code=-1)
-        for image in post.images:
-            path = photos.path(image.filename)
-            os.remove(path)
-        db.session.delete(post)
+        for filename in set(image.filename for image in post.images):
+            storage.bury(filename)
+        search.unindex_post(post.id)
+        sync.delete_post(user, post)
         db.session.commit()
+        posts_changed(user)
+        storage.file_reaper.notify()
         return jsonify({'message': 'Deleted.', 'status_code': 0}), 200
 
 
 class PostsAPI(MethodView):
     decorators = [auth_required]
 
+    @read_only
     def get(self):
-        # page = request.args.get('page', 1, type=int)
-        # per_page = 6
-        # pagination = Post.query.with_parent(g.current_user).paginate(page, per_page)
-        # posts = pagination.items
-        # current = url_for('.posts', page=page, _external=True)
-        # prev = None
-        # if pagination.has_prev:
-            # prev = url_for('.posts', page=page - 1, _external=True)
-        # next = None
-        # if pagination.has_next:
-            # next = url_for('.posts', page=page + 1, _external=True)
-        # datas = posts_schema(posts, current, prev, next, pagination)
-        posts = Post.query.with_parent(g.current_user)
-        datas = posts_schema(posts)
-        datas['status_code'] = 0
-        return jsonify(datas)
-
+        user = g.current_user
+        limit = request.args.get('limit', current_app.config['LREVIEW_POSTS_PER_PAGE'], type=int)
+        limit = max(1, min(limit, current_app.config['LREVIEW_POSTS_MAX_PER_PAGE']))
+        cursor = request.args.get('cursor')
+        fields = requested_fields(POST_FIELDS)
+        meta = user_meta(user)
+        etag = make_etag('posts', user.id, meta.version, cursor, limit, fields)
+        response = not_modified(etag, meta.updated_at)
+        if response is not None:
+            return response
+
+        query = Post.query.with_parent(user).options(*post_options(fields))
+        posts, prev_cursor, next_cursor = keyset_page(query, cursor, limit)
+        images = images_by_post(posts) if wants_images(fields) else None
+        field_list = ','.join(fields) if fields is not None else None
+        current = url_for('.posts', cursor=cursor, limit=limit, fields=field_list, _external=True)
+        prev = None
+        if prev_cursor is not None:
+            prev = url_for('.posts', cursor=prev_cursor, limit=limit, fields=field_list, _external=True)
+        next = None
+        if next_cursor is not None:
+            next = url_for('.posts', cursor=next_cursor, limit=limit, fields=field_list, _external=True)
+        envelope = posts_schema([], None, current, prev, next, meta.posts_count, fields)
+        envelope['status_code'] = 0
+        items = (post_schema(post, images[post.id] if images is not None else None, fields) for post in posts)
+        return streamed_response(json_chunks(envelope, 'posts', items), etag, meta.updated_at)
 
     def post(self):
         user = g.current_user
@@ -236,38 +292,213 @@ class PostsAPI(MethodView):
         introspection = request.form.get('introspection')
         emotion = request.form.get('emotion')
         score = request.form.get('score')
+        staged = storage.stage_all(request.files.getlist('images'))
+
+        with storage.committing(staged) as filenames:
+            user.count_posts(1)
+            post = Post(title=title, body=body, happen_age=happen_age, introspection=introspection, emotion=emotion, score=score, user=user,
+                        change_seq=user.next_change())
+            db.session.add(post)
+            post.add_images(filenames)
+            CurvePoint.sync(post)
+            search.index_post(post)
+        posts_changed(user)
+
+        datas = post_schema(post)
+        datas['status_code'] = 0
+        response = json_response(datas, 201)
+        response.headers['Location'] = url_for('.posts', post_id=post.id, _external=True)
+        return response
 
-        post = Post(title=title, body=body, happen_age=happen_age, introspection=introspection, emotion=emotion, score=score, user=user)
-        db.session.add(post)
-        db.session.commit()
 
-        if request.files.getlist('images'):
-            for filename in request.files.getlist('images'):
-                name = hashlib.md5((user.username + str(time.time())).encode('UTF-8'))
-                name = name.hexdigest()[:15]
-                filename = photos.save(filename, name=name + '.')
+class PostsExportAPI(MethodView):
+    decorators = [auth_required]
+
+    def get(self):
+        user = g.current_user
+        batch_size = current_app.config['LREVIEW_EXPORT_BATCH_SIZE']
+
+        def lines(posts):
+            images = images_by_post(posts)
+            for post in posts:
+                yield dumps(export_record(post, images[post.id])) + b'\n'
+
+        def generate():
+            # a server-side cursor keeps memory flat whatever the size of the history
+            posts = []
+            for post in Post.query.with_parent(user).order_by(Post.id).yield_per(batch_size):
+                posts.append(post)
+                if len(posts) == batch_size:
+                    yield b''.join(lines(posts))
+                    posts = []
+            if posts:
+                yield b''.join(lines(posts))
+
+        response = current_app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+        response.headers['Content-Disposition'] = 'attachment; filename=posts.ndjson'
+        return response
+
+
+class PostsImportAPI(MethodView):
+    decorators = [auth_required]
 
-                image = Image(filename=filename, post=post)
-                db.session.add(image)
+    def post(self):
+        user = g.current_user
+        config = current_app.config
+        imported = 0
+        errors = []
+        batch = []
+
+        def flush(batch):
+            try:
+                user.count_posts(len(batch))
+                for number, post in batch:
+                    CurvePoint.sync(post)
+                    search.index_post(post)
                 db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                errors.extend({'line': number, 'message': 'Not saved: %s' % e.__class__.__name__} for number, post in batch)
+                return 0
+            return len(batch)
+
+        for number, line in read_lines(request.stream, config['LREVIEW_IMPORT_MAX_LINE']):
+            if line is None:
+                errors.append({'line': number, 'message': 'Line too long.'})
+                continue
+            try:
+                fields, filenames = parse_record(line)
+            except ValidationError as e:
+                errors.append({'line': number, 'message': e.args[0]})
+                continue
+            if not batch:
+                # one change per batch, stamped before the posts so their inserts carry it
+                seq = user.next_change()
+            post = Post(user=user, change_seq=seq, **fields)
+            db.session.add(post)
+            post.add_images(filenames)
+            batch.append((number, post))
+            if len(batch) >= config['LREVIEW_IMPORT_BATCH_SIZE']:
+                imported += flush(batch)
+                batch = []
+        if batch:
+            imported += flush(batch)
+        posts_changed(user)
+
+        return jsonify({
+            'kind': 'ImportResult',
+            'imported': imported,
+            'error_count': len(errors),
+            'errors': errors[:config['LREVIEW_IMPORT_MAX_ERRORS']],
+            'status_code': 0
+        }), 200
+
+
+class PostChangesAPI(MethodView):
+    decorators = [auth_required]
 
-        datas = post_schema(post)
+    def get(self):
+        """Posts changed and deleted since a sync token, a missing token means everything."""
+        user = g.current_user
+        since = request.args.get('since')
+        position = None
+        if since is not None:
+            try:
+                position = sync.parse_token(since)
+            except ValueError:
+                raise ValidationError('Invalid sync token.')
+            if position[0] < sync.sync_floor(user):
+                return api_abort(410, message='Sync token expired, download all posts again.', status_code=-1)
+        limit = request.args.get('limit', current_app.config['LREVIEW_POSTS_MAX_PER_PAGE'], type=int)
+        limit = max(1, min(limit, current_app.config['LREVIEW_POSTS_MAX_PER_PAGE']))
+
+        posts, tombstones, position, has_more = sync.changes(user, position, limit)
+        token = sync.format_token(position)
+        images = images_by_post(posts)
+        datas = {
+            'kind': 'PostChanges',
+            'upserts': [post_schema(post, images[post.id]) for post in posts],
+            'deletions': [{'kind': tombstone.kind, 'id': tombstone.object_id} for tombstone in tombstones],
+            'sync_token': token,
+            'has_more': has_more,
+            'self': url_for('.changes', since=since, limit=limit, _external=True),
+            'next': url_for('.changes', since=token, limit=limit, _external=True),
+            'status_code': 0
+        }
+        return json_response(datas)
+
+
+class PostSearchAPI(MethodView):
+    decorators = [auth_required]
+
+    def get(self):
+        user = g.current_user
+        q = request.args.get('q', '').strip()
+        if not q:
+            raise ValidationError('Query missing.')
+        page = max(request.args.get('page', 1, type=int), 1)
+        limit = request.args.get('limit', current_app.config['LREVIEW_POSTS_PER_PAGE'], type=int)
+        limit = max(1, min(limit, current_app.config['LREVIEW_POSTS_MAX_PER_PAGE']))
+
+        # one extra row tells whether there is a next page
+        posts = search.search_posts(user, q, (page - 1) * limit, limit + 1)
+        has_next = len(posts) > limit
+        posts = posts[:limit]
+        images = images_by_post(posts)
+        current = url_for('.search', q=q, page=page, limit=limit, _external=True)
+        prev = None
+        if page > 1:
+            prev = url_for('.search', q=q, page=page - 1, limit=limit, _external=True)
+        next = None
+        if has_next:
+            next = url_for('.search', q=q, page=page + 1, limit=limit, _external=True)
+        datas = posts_schema(posts, images, current, prev, next, len(posts))
+        datas['kind'] = 'PostSearchResult'
+        datas['query'] = q
         datas['status_code'] = 0
-        response = jsonify(datas)
-        response.status_code = 201
-        response.headers['Location'] = url_for('.posts', post_id=post.id, _external=True)
-        return response
+        return json_response(datas)
+
+
+class StatsAPI(MethodView):
+    decorators = [auth_required]
+
+    def get(self):
+        user = g.current_user
+        bucket = request.args.get('bucket', 10, type=int)
+        if not 1 <= bucket <= 100:
+            raise ValidationError('Bucket must be between 1 and 100.')
+        meta = user_meta(user)
+        etag = make_etag('stats', user.id, meta.version, bucket)
+        response = not_modified(etag, meta.updated_at)
+        if response is not None:
+            return response
+
+        datas = stats.user_stats(user.id, meta.version, bucket)
+        datas = dict(datas, kind='Stats', bucket=bucket, status_code=0,
+                     self=url_for('.stats', bucket=bucket, _external=True))
+        return add_validators(json_response(datas), etag, meta.updated_at)
 
 
 class Curve(MethodView):
     decorators = [auth_required]
 
+    @read_only
     def get(self):
         user = g.current_user
-        posts = user.posts
-        datas = curve_schema(posts)
-        datas['status_code'] = 0
-        return jsonify(datas)
+        fields = requested_fields(CURVE_FIELDS)
+        meta = user_meta(user)
+        etag = make_etag('curve', user.id, meta.version, fields)
+        response = not_modified(etag, meta.updated_at)
+        if response is not None:
+            return response
+
+        query = CurvePoint.query.filter_by(user_id=user.id).options(*curve_options(fields)).order_by(CurvePoint.post_id)
+        # executed here, while reads still go to the replica, and fetched as the body streams
+        points = iter(query.yield_per(current_app.config['LREVIEW_EXPORT_BATCH_SIZE']))
+        envelope = curve_schema([], fields)
+        envelope['status_code'] = 0
+        items = (curve_point_schema(point, fields) for point in points)
+        return streamed_response(json_chunks(envelope, 'curve', items), etag, meta.updated_at)
 
 
 api_v1.add_url_rule('/register', view_func=Register.as_view('register'), methods=['POST'])
@@ -277,5 +508,10 @@ api_v1.add_url_rule('/oauth/token', view_func=AuthTokenAPI.as_view('token'), met
 api_v1.add_url_rule('/user', view_func=UserAPI.as_view('user'), methods=['GET', 'PUT'])
 api_v1.add_url_rule('/user/avatar', view_func=Avatar.as_view('avatar'), methods=['PUT'])
 api_v1.add_url_rule('/user/posts', view_func=PostsAPI.as_view('posts'), methods=['GET', 'POST'])
+api_v1.add_url_rule('/user/posts/export', view_func=PostsExportAPI.as_view('export'), methods=['GET'])
+api_v1.add_url_rule('/user/posts/import', view_func=PostsImportAPI.as_view('import'), methods=['POST'])
+api_v1.add_url_rule('/user/posts/changes', view_func=PostChangesAPI.as_view('changes'), methods=['GET'])
+api_v1.add_url_rule('/user/posts/search', view_func=PostSearchAPI.as_view('search'), methods=['GET'])
 api_v1.add_url_rule('/user/post/<int:post_id>', view_func=PostAPI.as_view('post'), methods=['GET', 'PUT', 'DELETE'])
+api_v1.add_url_rule('/user/stats', view_func=StatsAPI.as_view('stats'), methods=['GET'])
 api_v1.add_url_rule('user/curve', view_func=Curve.as_view('curve'), methods=['GET'])
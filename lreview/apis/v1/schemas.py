@@ -1,13 +1,63 @@
-from flask import url_for
+from flask import url_for, g, current_app
 from lreview.models import Post, Image
-from lreview.extensions import photos
+from lreview.metrics import timed_serialization
+from lreview.apis.v1.fields import wants_images
 import functools
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 url_for = functools.partial(url_for, _scheme='https')
 
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+@timed_serialization
+def dumps(datas):
+    if orjson is not None:
+        return orjson.dumps(datas)
+    return _encoder.encode(datas).encode('utf-8')
+
+
+def json_response(datas, status=200):
+    return current_app.response_class(dumps(datas), status=status, mimetype='application/json')
+
+
+class URLs(object):
+    """URLs resolved once per request, ids and filenames are appended to the prefixes."""
+
+    def __init__(self):
+        self.user = url_for('.user', _external=True)
+        self.posts = url_for('.posts', _external=True)
+        self.curve = url_for('.curve', _external=True)
+        self.post_prefix = url_for('.post', post_id=0, _external=True)[:-1]
+        self.photo_prefix = url_for('media.photo', filename='_', _external=True)[:-1]
+        self.default_story = self.photo_prefix + 'default/defaultStory.png'
+        self.preview_suffix = '?w=%d' % current_app.config['MEDIA_PREVIEW_WIDTH']
+
+    def post(self, post_id):
+        return self.post_prefix + str(post_id)
+
+    def photo(self, filename):
+        return self.photo_prefix + filename
+
+    def preview(self, filename):
+        return self.photo_prefix + filename + self.preview_suffix
 
+
+def urls():
+    if 'schema_urls' not in g:
+        g.schema_urls = URLs()
+    return g.schema_urls
+
+
+@timed_serialization
 def user_schema(user):
+    u = urls()
     return {
         'kind': 'User',
         'id': user.id,
@@ -15,18 +65,65 @@ def user_schema(user):
         'username': user.username,
         'name': user.name,
         'birthday': user.birthday,
-        'avatar': photos.url(user.avatar),
-        'self': url_for('.user', _external=True),
-        'posts_url': url_for('.posts', _external=True),
-        'posts_count': user.posts.count()
+        'avatar': u.photo(user.avatar),
+        'self': u.user,
+        'posts_url': u.posts,
+        'posts_count': user.posts_count
     }
 
 
-def post_schema(post):
+def images_by_post(posts):
+    """Load the images of many posts with a single query, none when no post has images."""
+    images = {post.id: [] for post in posts}
+    with_images = [post.id for post in posts if post.image_count]
+    if with_images:
+        for image in Image.query.filter(Image.post_id.in_(with_images)).order_by(Image.id):
+            images[image.post_id].append(image)
+    return images
+
+
+def _post_user(post, images, u):
+    return {'kind': 'User', 'id': post.user.id, 'url': u.user, 'username': post.user.username}
+
+
+# for sparse fieldsets, only the getters of requested fields run so unloaded columns stay unloaded
+POST_GETTERS = {
+    'id': lambda post, images, u: post.id,
+    'self': lambda post, images, u: u.post(post.id),
+    'title': lambda post, images, u: post.title,
+    'body': lambda post, images, u: post.body,
+    'happen_age': lambda post, images, u: post.happen_age,
+    'introspection': lambda post, images, u: post.introspection,
+    'emotion': lambda post, images, u: post.emotion,
+    'score': lambda post, images, u: post.score,
+    'user': _post_user,
+    'images': lambda post, images, u: [u.photo(image.filename) for image in images] if images else [u.default_story],
+    'thumbnails': lambda post, images, u: [u.preview(image.filename) for image in images] if images else [u.default_story + u.preview_suffix]
+}
+
+CURVE_GETTERS = {
+    'title': lambda point, u: point.title,
+    'happen_age': lambda point, u: point.happen_age,
+    'score': lambda point, u: point.score,
+    'cover': lambda point, u: u.photo(point.cover) if point.cover else u.default_story,
+    'cover_thumbnail': lambda point, u: u.preview(point.cover) if point.cover else u.default_story + u.preview_suffix
+}
+
+
+@timed_serialization
+def post_schema(post, images=None, fields=None):
+    if images is None and wants_images(fields):
+        images = post.images.all() if post.image_count else []
+    u = urls()
+    if fields is not None:
+        datas = {'kind': 'Post'}
+        for field in fields:
+            datas[field] = POST_GETTERS[field](post, images, u)
+        return datas
     return {
         'kind': 'Post',
         'id': post.id,
-        'self': url_for('.post', post_id=post.id, _external=True),
+        'self': u.post(post.id),
         'title': post.title,
         'body': post.body,
         'happen_age': post.happen_age,
@@ -36,30 +133,41 @@ def post_schema(post):
         'user': {
             'kind': 'User',
             'id': post.user.id,
-            'url': url_for('.user', _external=True),
+            'url': u.user,
             'username': post.user.username
         },
-        'images': [photos.url(image.filename) for image in post.images] if post.images.count() > 0 else [photos.url('default/defaultStory.png')]
+        'images': [u.photo(image.filename) for image in images] if images else [u.default_story],
+        'thumbnails': [u.preview(image.filename) for image in images] if images else [u.default_story + u.preview_suffix]
     }
 
 
-def posts_schema(posts):
+@timed_serialization
+def posts_schema(posts, images, current, prev, next, count, fields=None):
+    """images maps post ids to their images, it may be None when fields leaves images out."""
     return {
         'kind': 'PostCollection',
-        'posts': [post_schema(post) for post in posts],
-        # 'first': url_for('.posts', page=1, _external=True),
-        # 'last': url_for('.posts', page=pagination.pages, _external=True),
-        'self': url_for('.posts', _external=True),
-        # 'prev': prev,
-        # 'next': next,
-        'count': posts.count()
+        'posts': [post_schema(post, images[post.id] if images is not None else None, fields) for post in posts],
+        'self': current,
+        'prev': prev,
+        'next': next,
+        'count': count
     }
 
 
-def curve_schema(posts):
+@timed_serialization
+def curve_point_schema(point, fields=None):
+    u = urls()
+    if fields is not None:
+        return {field: CURVE_GETTERS[field](point, u) for field in fields}
+    return {'title': point.title, 'happen_age': point.happen_age, 'score': point.score,
+            'cover': u.photo(point.cover) if point.cover else u.default_story,
+            'cover_thumbnail': u.preview(point.cover) if point.cover else u.default_story + u.preview_suffix}
+
 
+@timed_serialization
+def curve_schema(points, fields=None):
     return {
         'kind': 'CurveCollection',
-        'self': url_for('.curve', _external=True),
-        'curve': [{'title': post.title, 'happen_age': post.happen_age, 'score': post.score, 'cover': photos.url(post.images[0].filename) if post.images.count() > 0 else photos.url('default/defaultStory.png') } for post in posts]
+        'self': urls().curve,
+        'curve': [curve_point_schema(point, fields) for point in points]
     }
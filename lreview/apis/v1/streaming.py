@@ -0,0 +1,91 @@
+import zlib
+
+from flask import current_app, request, stream_with_context
+
+from lreview.apis.v1.conditional import add_validators
+from lreview.apis.v1.schemas import dumps
+
+
+CHUNK_SIZE = 16 * 1024
+ENCODINGS = ('gzip', 'deflate')
+
+
+def json_chunks(envelope, key, items):
+    """Yield the JSON of envelope in pieces, with the items streamed in as envelope[key].
+
+    envelope[key] must be an empty list; items are encoded one by one and
+    sent in chunks of about CHUNK_SIZE bytes.
+    """
+    marker = b'"%s":[]' % key.encode('ascii')
+    encoded = dumps(envelope)
+    # keys are unique and quotes inside strings are escaped, so the marker occurs once
+    index = encoded.index(marker) + len(marker) - 1
+    buffer = [encoded[:index]]
+    size = index
+    separator = b''
+    for item in items:
+        data = separator + dumps(item)
+        separator = b','
+        buffer.append(data)
+        size += len(data)
+        if size >= CHUNK_SIZE:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    buffer.append(encoded[index:])
+    yield b''.join(buffer)
+
+
+def _compress(chunks, encoding, level):
+    # gzip wants a gzip header, HTTP deflate is the zlib format
+    wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS
+    compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+    for chunk in chunks:
+        # a sync flush per chunk keeps bytes flowing instead of waiting on zlib's window
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def streamed_response(chunks, etag, last_modified=None):
+    """Send chunks of JSON as they are produced, compressed when the client accepts it and the body is large enough.
+
+    The head of the stream is buffered up to LREVIEW_COMPRESS_MIN_SIZE bytes
+    to decide; smaller bodies go out whole and uncompressed.
+    """
+    config = current_app.config
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    chunks = iter(chunks)
+    head = []
+    size = 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size >= config['LREVIEW_COMPRESS_MIN_SIZE']:
+            break
+    else:
+        response = current_app.response_class(b''.join(head), mimetype='application/json')
+        response.vary.add('Accept-Encoding')
+        return add_validators(response, etag, last_modified)
+
+    head = b''.join(head)
+
+    def body():
+        yield head
+        for chunk in chunks:
+            yield chunk
+
+    if encoding is None:
+        response = current_app.response_class(stream_with_context(body()), mimetype='application/json')
+    else:
+        response = current_app.response_class(
+            stream_with_context(_compress(body(), encoding, config['LREVIEW_COMPRESS_LEVEL'])),
+            mimetype='application/json')
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    add_validators(response, etag, last_modified)
+    if encoding is not None:
+        # the bytes differ per encoding, the content does not
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,66 @@
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundWorker(object):
+    """Calls run_once() on a daemon thread when notified, or every poll interval.
+
+    Subclasses set config_prefix and read <prefix>_AUTOSTART and
+    <prefix>_POLL_INTERVAL from the app config.
+    """
+
+    config_prefix = None
+    thread_name = 'lreview-worker'
+
+    def __init__(self, app):
+        self.app = app
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def config(self, key):
+        return self.app.config['%s_%s' % (self.config_prefix, key)]
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self.on_start()
+            self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def notify(self):
+        if self.config('AUTOSTART'):
+            self.start()
+        self._wakeup.set()
+
+    def on_start(self):
+        """Hook called before the thread starts."""
+
+    def run_once(self):
+        """Do one round of work in an app context, return a true value if there may be more."""
+        raise NotImplementedError
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                with self.app.app_context():
+                    busy = self.run_once()
+            except Exception:
+                logger.exception('%s failed.', self.thread_name)
+                busy = False
+            if not busy:
+                self._wakeup.wait(self.config('POLL_INTERVAL'))
+                self._wakeup.clear()
@@ -0,0 +1,40 @@
+from sqlalchemy import func, select
+
+from lreview.extensions import db
+from lreview.models import User, Post, Image
+
+
+def _post_count():
+    return select([func.count(Post.id)]).where(Post.user_id == User.id).as_scalar()
+
+
+def _image_count():
+    return select([func.count(Image.id)]).where(Image.post_id == Post.id).as_scalar()
+
+
+def _cover():
+    return select([Image.filename]).where(Image.post_id == Post.id).order_by(Image.id).limit(1).as_scalar()
+
+
+def backfill():
+    """Recompute every denormalized counter and cover with set-based updates."""
+    db.session.execute(User.__table__.update().values(posts_count=_post_count()))
+    db.session.execute(Post.__table__.update().values(image_count=_image_count(), cover_filename=_cover()))
+    db.session.commit()
+
+
+def mismatches(limit=None):
+    """Return (table, id, column, stored, actual) for values out of step with the rows they summarize."""
+    found = []
+    checks = (
+        ('user', User.id, User.posts_count, _post_count()),
+        ('post', Post.id, Post.image_count, _image_count()),
+        ('post', Post.id, Post.cover_filename, _cover())
+    )
+    for table, key, column, actual in checks:
+        actual = actual.label('actual')
+        query = db.session.query(key, column, actual).filter(column.is_distinct_from(actual)).order_by(key)
+        if limit is not None:
+            query = query.limit(limit)
+        found.extend((table, row[0], column.key, row[1], row[2]) for row in query)
+    return found
@@ -0,0 +1,85 @@
+import functools
+
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.pool import QueuePool
+
+
+REPLICA = 'replica'
+
+
+def _pragmas(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
+
+    return on_connect
+
+
+class RoutingSession(SignallingSession):
+    """Sends reads to the replica bind inside views marked with read_only()."""
+
+    def __init__(self, db, **options):
+        self.db = db
+        super(RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and has_app_context() and g.get('read_only') and \
+                REPLICA in (self.app.config['SQLALCHEMY_BINDS'] or {}):
+            return self.db.get_engine(self.app, bind=REPLICA)
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+    """Flask-SQLAlchemy with pool sizing, SQLite pragmas and replica routing from the app config."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        in_memory = sa_url.drivername == 'sqlite' and sa_url.database in (None, '', ':memory:')
+        rv = super(SQLAlchemy, self).apply_driver_hacks(app, sa_url, options)
+        if rv is not None:
+            # from 2.5 on, (sa_url, options) is returned and must be passed on
+            sa_url, options = rv
+        if in_memory:
+            # one shared connection holds the whole database
+            return rv
+        if sa_url.drivername == 'sqlite':
+            # the default NullPool reopens the file and reruns the pragmas on every checkout
+            options['poolclass'] = QueuePool
+            options.setdefault('connect_args', {})['check_same_thread'] = False
+        else:
+            options['pool_pre_ping'] = True
+        options['pool_size'] = app.config['DATABASE_POOL_SIZE']
+        options['max_overflow'] = app.config['DATABASE_MAX_OVERFLOW']
+        options['pool_recycle'] = app.config['DATABASE_POOL_RECYCLE']
+        return rv
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super(SQLAlchemy, self).create_engine(sa_url, engine_opts)
+        pragmas = self.get_app().config['SQLITE_PRAGMAS']
+        if engine.dialect.name == 'sqlite' and pragmas:
+            event.listen(engine, 'connect', _pragmas(pragmas))
+        return engine
+
+
+def read_only(f):
+    """Let the queries of a view that writes nothing go to the replica, when one is configured.
+
+    Validators must be read inside the view too, and before the body: a
+    lagging replica then yields an old ETag with an old body, never a new
+    ETag with a stale one.
+    """
+    @functools.wraps(f)
+    def decorated(*args, **kwargs):
+        g.read_only = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            g.read_only = False
+
+    return decorated
@@ -1,9 +1,10 @@
-from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_migrate import Migrate
 from flask_mail import Mail
 from flask_uploads import UploadSet, IMAGES
 
+from lreview.database import SQLAlchemy
+
 
 db = SQLAlchemy()
 login_manager = LoginManager()
@@ -0,0 +1,74 @@
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HashingBusy(Exception):
+    """Raised when too many hashes are already queued."""
+
+
+_pool = None
+_pool_pid = None
+_slots = None
+_lock = threading.Lock()
+
+
+def _new_pool(workers):
+    if sys.version_info < (3, 7):
+        return ProcessPoolExecutor(max_workers=workers)
+    # children forked from a threaded web worker may inherit locks held by other threads
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+
+def _executor(broken=None):
+    """Return the pool and its slots, building a new pool in place of broken."""
+    global _pool, _pool_pid, _slots
+    with _lock:
+        # a forked worker must not reuse the pool of its parent
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = _new_pool(current_app.config['PASSWORD_HASH_WORKERS'])
+            _pool_pid = os.getpid()
+            _slots = threading.BoundedSemaphore(current_app.config['PASSWORD_HASH_MAX_PENDING'])
+        elif broken is not None and _pool is broken:
+            broken.shutdown(wait=False)
+            _pool = _new_pool(current_app.config['PASSWORD_HASH_WORKERS'])
+        return _pool, _slots
+
+
+def _run(func, *args):
+    """Run a hash function off the GIL on the process pool, or inline without workers."""
+    if not current_app.config['PASSWORD_HASH_WORKERS']:
+        return func(*args)
+    pool, slots = _executor()
+    if not slots.acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        try:
+            return pool.submit(func, *args).result()
+        except BrokenProcessPool:
+            # a child died, e.g. to the OOM killer, and the pool never recovers by itself
+            pool, _ = _executor(broken=pool)
+            return pool.submit(func, *args).result()
+    finally:
+        slots.release()
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, current_app.config['PASSWORD_HASH_METHOD'])
+
+
+def verify_password(pwhash, password):
+    return _run(check_password_hash, pwhash, password)
+
+
+def needs_rehash(pwhash):
+    """Tell whether a hash was made with other parameters than PASSWORD_HASH_METHOD."""
+    return pwhash.split('$', 1)[0] != current_app.config['PASSWORD_HASH_METHOD']
@@ -0,0 +1,140 @@
+import mimetypes
+import os
+import re
+
+from flask import Blueprint, abort, current_app, request
+from werkzeug.wsgi import wrap_file
+
+from lreview.cache import TTLCache
+from lreview.extensions import photos
+from lreview.thumbnails import thumbnails
+
+
+media_bp = Blueprint('media', __name__)
+
+# names written by lreview.storage, the content never changes under them
+CONTENT_NAME_RE = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})\.[0-9a-zA-Z]+$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+class FileInfo(object):
+    __slots__ = ('name', 'path', 'size', 'mtime', 'mimetype', 'etag', 'immutable')
+
+    def __init__(self, name, path, size, mtime, etag, immutable):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.etag = etag
+        self.immutable = immutable
+
+    @classmethod
+    def from_stat(cls, filename, path, stat):
+        mtime = int(stat.st_mtime)
+        match = CONTENT_NAME_RE.match(filename)
+        # the digest is a strong validator, other files fall back to mtime and size
+        etag = match.group(1) if match else '%x-%x' % (mtime, stat.st_size)
+        return cls(filename, path, stat.st_size, mtime, etag, match is not None)
+
+    def variant(self, name, path, size, width):
+        """Describe a thumbnail of this file, it changes only when the original does."""
+        return FileInfo(name, path, size, self.mtime, '%s-w%d' % (self.etag, width), self.immutable)
+
+
+def _stat_cache():
+    cache = current_app.extensions.get('media_stat_cache')
+    if cache is None:
+        cache = current_app.extensions['media_stat_cache'] = TTLCache(
+            current_app.config['MEDIA_STAT_CACHE_SIZE'], current_app.config['MEDIA_STAT_CACHE_TTL'])
+    return cache
+
+
+def file_info(filename):
+    """Return the cached FileInfo of a stored file, None if there is no such file."""
+    cache = _stat_cache()
+    info = cache.get(filename)
+    if info is not None:
+        return info
+    # hidden entries such as the upload staging area are not served
+    if any(not part or part.startswith('.') for part in filename.split('/')) or '\\' in filename:
+        return None
+    path = os.path.join(photos.config.destination, *filename.split('/'))
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if not os.path.isfile(path):
+        return None
+    info = FileInfo.from_stat(filename, path, stat)
+    cache.set(filename, info)
+    return info
+
+
+def forget(filename):
+    """Drop the cached stat and the thumbnails of a file, call it after unlinking one."""
+    _stat_cache().pop(filename)
+    cache = thumbnails()
+    if cache is not None:
+        cache.discard(filename, current_app.config['MEDIA_THUMBNAIL_WIDTHS'])
+
+
+def thumbnail_info(info, width):
+    """Return the FileInfo of a thumbnail of a file, None if it has no thumbnails."""
+    cache = thumbnails()
+    if cache is None:
+        return None
+    variant = cache.get(info.name, info.path, width)
+    if variant is None:
+        return None
+    return info.variant(*variant, width=width)
+
+
+def _open(info):
+    try:
+        return open(info.path, 'rb')
+    except OSError:
+        return None
+
+
+@media_bp.route('/<path:filename>')
+def photo(filename):
+    info = original = file_info(filename)
+    if info is None:
+        abort(404)
+    width = request.args.get('w', type=int)
+    if width is not None:
+        if width not in current_app.config['MEDIA_THUMBNAIL_WIDTHS']:
+            abort(404)
+        # without Pillow, or for files Pillow cannot read, the original is served
+        info = thumbnail_info(info, width) or info
+
+    config = current_app.config
+    offload = config['MEDIA_ACCEL_REDIRECT_PREFIX'] or current_app.use_x_sendfile
+    if offload:
+        # the front proxy sends the body and answers Range itself
+        response = current_app.response_class(mimetype=info.mimetype)
+        if config['MEDIA_ACCEL_REDIRECT_PREFIX']:
+            response.headers['X-Accel-Redirect'] = config['MEDIA_ACCEL_REDIRECT_PREFIX'] + info.name
+        else:
+            response.headers['X-Sendfile'] = info.path
+    else:
+        f = _open(info)
+        if f is None and info is not original:
+            # a thumbnail evicted by another process since it was looked up
+            info = original
+            f = _open(info)
+        if f is None:
+            # unlinked since it was cached
+            forget(filename)
+            abort(404)
+        response = current_app.response_class(wrap_file(request.environ, f), mimetype=info.mimetype,
+                                              direct_passthrough=True)
+    response.content_length = info.size
+    response.last_modified = info.mtime
+    response.set_etag(info.etag)
+    if info.immutable:
+        response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % IMMUTABLE_MAX_AGE
+    else:
+        response.headers['Cache-Control'] = 'public, max-age=%d' % config['MEDIA_MAX_AGE']
+    return response.make_conditional(request, accept_ranges=not offload, complete_length=info.size)
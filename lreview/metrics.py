@@ -0,0 +1,274 @@
+import functools
+import logging
+import threading
+import time
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+# set in the WSGI environ of the sub-requests that /batch dispatches
+BATCH_ITEM = 'lreview.batch_item'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, **kwargs):
+        amount = kwargs.get('amount', 1)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield self.name + _labels(self.labelnames, labels), value
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(object):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def totals(self, *labels):
+        """Return (sum, count) of the observations."""
+        series = self._series.get(labels)
+        return (0.0, 0) if series is None else (series[-2], series[-1])
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # per-bucket counts, then sum and count
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield self.name + '_bucket' + _labels(self.labelnames, labels, ('le', _number(bound))), cumulative
+            yield self.name + '_sum' + _labels(self.labelnames, labels), series[-2]
+            yield self.name + '_count' + _labels(self.labelnames, labels), series[-1]
+
+
+class Sampled(object):
+    """A metric whose samples are read from a callback at scrape time."""
+
+    def __init__(self, name, documentation, kind, func):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.func = func
+
+    def samples(self):
+        yield self.name, self.func()
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for name, value in metric.samples():
+                lines.append('%s %s' % (name, _number(value)))
+        return '\n'.join(lines) + '\n'
+
+
+class RequestStats(object):
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.serialize_depth = 0
+        self.statements = []
+        self.status = None
+
+
+def current_stats():
+    if has_request_context():
+        return g.get('request_stats')
+    return None
+
+
+def timed_serialization(f):
+    """Add the time spent in f to the serialization time of the request, nested calls count once."""
+    @functools.wraps(f)
+    def decorated(*args, **kwargs):
+        stats = current_stats()
+        if stats is None:
+            return f(*args, **kwargs)
+        stats.serialize_depth += 1
+        start = time.perf_counter()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            stats.serialize_depth -= 1
+            if not stats.serialize_depth:
+                stats.serialize_time += time.perf_counter() - start
+
+    return decorated
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('lreview_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('lreview_query_start')
+    if not starts:
+        return
+    start = starts.pop()
+    stats = current_stats()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - start
+        stats.statements.append(statement)
+
+
+def _handle_error(context):
+    if context.connection is not None:
+        starts = context.connection.info.get('lreview_query_start')
+        if starts:
+            starts.pop()
+
+
+_listening = False
+
+
+class Metrics(object):
+    def __init__(self, app):
+        self.app = app
+        self.registry = Registry()
+        labels = ('endpoint', 'method')
+        self.requests = self.registry.register(Counter(
+            'lreview_requests_total', 'Requests served.', labels + ('status',)))
+        self.latency = self.registry.register(Histogram(
+            'lreview_request_duration_seconds', 'Total request latency.', labels))
+        self.queries = self.registry.register(Histogram(
+            'lreview_request_queries', 'SQL statements per request.', labels, QUERY_BUCKETS))
+        self.db_time = self.registry.register(Histogram(
+            'lreview_request_db_seconds', 'Time spent in SQL per request.', labels))
+        self.serialize_time = self.registry.register(Histogram(
+            'lreview_request_serialize_seconds', 'Time spent building and encoding payloads per request.', labels))
+        self.slow_requests = self.registry.register(Counter(
+            'lreview_slow_requests_total', 'Requests over the query or latency threshold.', labels))
+
+    def before_request(self):
+        g.request_stats = RequestStats()
+
+    def after_request(self, response):
+        stats = current_stats()
+        if stats is not None:
+            stats.status = response.status_code
+        return response
+
+    def teardown_request(self, exc):
+        if request.environ.get(BATCH_ITEM):
+            # a sub-request of /batch, accounted to the batch itself
+            return
+        stats = g.pop('request_stats', None)
+        if stats is None or request.endpoint == 'metrics':
+            return
+        elapsed = time.perf_counter() - stats.start
+        endpoint = request.endpoint or 'unmatched'
+        labels = (endpoint, request.method)
+        status = stats.status if exc is None else 500
+        self.requests.inc(*(labels + (str(status),)))
+        self.latency.observe(elapsed, *labels)
+        self.queries.observe(stats.queries, *labels)
+        self.db_time.observe(stats.db_time, *labels)
+        self.serialize_time.observe(stats.serialize_time, *labels)
+
+        config = self.app.config
+        if stats.queries >= config['METRICS_SLOW_QUERY_COUNT'] or elapsed >= config['METRICS_SLOW_REQUEST_SECONDS']:
+            self.slow_requests.inc(*labels)
+            logger.warning('Slow request %s %s: %.3fs, %d queries (%.3fs in SQL)\n%s',
+                           request.method, request.full_path, elapsed, stats.queries, stats.db_time,
+                           '\n'.join(stats.statements))
+
+    def render(self):
+        return self.app.response_class(self.registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    global _listening
+    if not _listening:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+        _listening = True
+
+    metrics = app.extensions['metrics'] = Metrics(app)
+    app.before_request(metrics.before_request)
+    app.after_request(metrics.after_request)
+    app.teardown_request(metrics.teardown_request)
+    app.add_url_rule('/metrics', 'metrics', metrics.render)
+    return metrics
@@ -1,6 +1,6 @@
 from lreview.extensions import db
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from lreview.hashing import hash_password, verify_password
 
 
 class User(db.Model):
@@ -10,18 +10,49 @@ class User(db.Model):
     password_hash = db.Column(db.String(128), nullable=False)
     name = db.Column(db.String(16), nullable=False)
     birthday = db.Column(db.String(10), nullable=False)
-    avatar = db.Column(db.String(64), default='default/defaultAvatar.png')
+    avatar = db.Column(db.String(128), default='default/defaultAvatar.png', index=True)
+    token_generation = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    version = db.Column(db.Integer, default=1, server_default='1', nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # sync tokens below this lost their tombstones to pruning
+    sync_floor = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    # kept in step by the post write paths, `flask check-counters` verifies it
+    posts_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
 
     posts = db.relationship('Post', backref='user', lazy='dynamic')
+    curve_points = db.relationship('CurvePoint', backref='user', lazy='dynamic')
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def validate_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
+
+    def touch(self):
+        """Bump the version, call it whenever the user or any of its posts change.
+
+        The increment runs in SQL so concurrent writers never share a version,
+        which lets versions double as the change sequence of delta sync.
+        """
+        self.version = User.version + 1
+        self.updated_at = datetime.utcnow()
+
+    def count_posts(self, delta):
+        """Adjust posts_count in SQL, safe against concurrent writers."""
+        self.posts_count = User.posts_count + delta
+
+    def next_change(self):
+        """Touch the user and return the new version, to stamp changed posts and tombstones with."""
+        self.touch()
+        db.session.flush()
+        return self.version
 
 
 class Post(db.Model):
+    __table_args__ = (db.Index('ix_post_user_change_seq', 'user_id', 'change_seq'),
+                      # posts of a user newest first, the order of keyset pagination
+                      db.Index('ix_post_user_timestamp', 'user_id', 'timestamp', 'id'))
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(64))
     happen_age = db.Column(db.Integer)
@@ -30,13 +61,103 @@ class Post(db.Model):
     emotion = db.Column(db.String(64))
     score = db.Column(db.Integer)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    version = db.Column(db.Integer, default=1, server_default='1', nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # version of the user at the last change of the post, see User.next_change()
+    change_seq = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    # denormalized from the images, see add_images()
+    image_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    cover_filename = db.Column(db.String(128))
 
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     images = db.relationship('Image', backref='post', lazy='dynamic', cascade='all, delete')
+    curve_point = db.relationship('CurvePoint', backref='post', uselist=False, cascade='all, delete-orphan')
+
+    def touch(self):
+        """Bump the version in SQL, so concurrent edits of a post never share one and its ETag changes each time."""
+        self.version = Post.version + 1
+        self.updated_at = datetime.utcnow()
+
+    def add_images(self, filenames):
+        """Attach stored files to the post, keeping image_count and the cover in step."""
+        for filename in filenames:
+            db.session.add(Image(filename=filename, post=self))
+        if filenames:
+            if self.id is None:
+                self.image_count = (self.image_count or 0) + len(filenames)
+            else:
+                # in SQL, like User.count_posts(), so concurrent uploads to a post both count
+                self.image_count = Post.image_count + len(filenames)
+            if self.cover_filename is None:
+                self.cover_filename = filenames[0]
 
 
 class Image(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    filename = db.Column(db.String(64))
-    
-    post_id = db.Column(db.Integer, db.ForeignKey('post.id'))
\ No newline at end of file
+    filename = db.Column(db.String(128), index=True)
+
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), index=True)
+
+
+class CurvePoint(db.Model):
+    """Read-optimized projection of a post for the life curve."""
+    __table_args__ = (db.Index('ix_curve_point_user_post', 'user_id', 'post_id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(64))
+    happen_age = db.Column(db.Integer)
+    score = db.Column(db.Integer)
+    cover = db.Column(db.String(128))
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), unique=True)
+
+    @classmethod
+    def sync(cls, post):
+        point = post.curve_point
+        if point is None:
+            point = cls(post=post)
+            db.session.add(point)
+        point.user = post.user
+        point.title = post.title
+        point.happen_age = post.happen_age
+        point.score = post.score
+        point.cover = post.cover_filename
+        return point
+
+
+class OutboxEmail(db.Model):
+    __table_args__ = (db.Index('ix_outbox_email_status_next_attempt', 'status', 'next_attempt_at'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipients = db.Column(db.Text, nullable=False)
+    subject = db.Column(db.String(128))
+    html = db.Column(db.Text)
+    # pending -> sending -> sent / failed, a lapsed 'sending' lease is claimed again
+    status = db.Column(db.String(16), default='pending', nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_error = db.Column(db.Text)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+
+class FileTombstone(db.Model):
+    """A stored file that lost a reference, unlinked later by the reaper if nothing else uses it."""
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(128), nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+class SyncTombstone(db.Model):
+    """A deleted post, kept so delta sync can tell clients to drop their copy."""
+    __table_args__ = (db.Index('ix_sync_tombstone_user_change_seq', 'user_id', 'change_seq'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(16), default='Post', nullable=False)
+    object_id = db.Column(db.Integer, nullable=False)
+    change_seq = db.Column(db.Integer, nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
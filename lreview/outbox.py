@@ -0,0 +1,164 @@
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+from flask_mail import Message
+
+from lreview.background import BackgroundWorker
+from lreview.extensions import db, mail
+from lreview.metrics import Counter, Histogram
+from lreview.models import OutboxEmail
+
+
+logger = logging.getLogger(__name__)
+
+
+class Dispatcher(BackgroundWorker):
+    """Drains the email outbox on a background thread and a pool of senders."""
+
+    config_prefix = 'MAIL_OUTBOX'
+    thread_name = 'lreview-outbox'
+
+    def __init__(self, app):
+        super(Dispatcher, self).__init__(app)
+        self.sent = Counter('lreview_outbox_sent_total', 'Outbox emails sent.')
+        self.retried = Counter('lreview_outbox_retried_total', 'Outbox send attempts that will be retried.')
+        self.failed = Counter('lreview_outbox_failed_total', 'Outbox emails given up on.')
+        self.send_latency = Histogram('lreview_outbox_send_seconds', 'SMTP latency per outbox email.')
+        self._executor = None
+
+    def on_start(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.config('WORKERS'))
+
+    def stop(self, timeout=None):
+        super(Dispatcher, self).stop(timeout)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def run_once(self):
+        return self.dispatch(self._executor)
+
+    def dispatch(self, executor=None):
+        """Claim due emails and send them in batches, return the number claimed."""
+        batch_size = self.app.config['MAIL_OUTBOX_BATCH_SIZE']
+        ids = self._claim(batch_size * self.app.config['MAIL_OUTBOX_WORKERS'])
+        batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+        if executor is None:
+            for batch in batches:
+                self._send_batch(batch)
+        else:
+            for future in [executor.submit(self._send_batch, batch) for batch in batches]:
+                future.result()
+        return len(ids)
+
+    def _claim(self, limit):
+        now = datetime.utcnow()
+        lease_until = now + timedelta(seconds=self.app.config['MAIL_OUTBOX_LEASE'])
+        candidates = OutboxEmail.query.with_entities(
+            OutboxEmail.id, OutboxEmail.status, OutboxEmail.next_attempt_at).filter(
+            OutboxEmail.status.in_(('pending', 'sending')),
+            OutboxEmail.next_attempt_at <= now).order_by(OutboxEmail.next_attempt_at).limit(limit).all()
+
+        claimed = []
+        for email_id, status, next_attempt_at in candidates:
+            # another dispatcher may have claimed the row since we read it
+            updated = OutboxEmail.query.filter_by(
+                id=email_id, status=status, next_attempt_at=next_attempt_at).update(
+                {'status': 'sending', 'next_attempt_at': lease_until}, synchronize_session=False)
+            if updated:
+                claimed.append(email_id)
+        db.session.commit()
+        return claimed
+
+    def _send_batch(self, ids):
+        with self.app.app_context():
+            emails = OutboxEmail.query.filter(OutboxEmail.id.in_(ids)).all()
+            try:
+                # one SMTP session for the whole batch
+                with mail.connect() as connection:
+                    for email in emails:
+                        self._send_one(connection, email)
+            except Exception as e:
+                for email in emails:
+                    if email.status == 'sending':
+                        self._retry_later(email, e)
+            db.session.commit()
+
+    def _send_one(self, connection, email):
+        msg = Message(subject=email.subject, recipients=email.recipients.split(','), html=email.html)
+        start = time.perf_counter()
+        try:
+            connection.send(msg)
+        except Exception as e:
+            self._retry_later(email, e)
+            return
+        if not connection.mail.suppress:
+            # MAIL_SUPPRESS_SEND drops the message without any SMTP round trip
+            self.sent.inc()
+            self.send_latency.observe(time.perf_counter() - start)
+        email.status = 'sent'
+        email.sent_at = datetime.utcnow()
+        email.last_error = None
+
+    def _retry_later(self, email, error):
+        config = self.app.config
+        email.attempts += 1
+        email.last_error = repr(error)
+        if email.attempts >= config['MAIL_OUTBOX_MAX_ATTEMPTS']:
+            logger.error('Giving up on outbox email %s: %r', email.id, error)
+            self.failed.inc()
+            email.status = 'failed'
+            return
+        delay = min(config['MAIL_OUTBOX_BACKOFF'] * 2 ** (email.attempts - 1), config['MAIL_OUTBOX_MAX_BACKOFF'])
+        delay *= random.uniform(0.8, 1.2)
+        self.retried.inc()
+        email.status = 'pending'
+        email.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+
+    def queue_depth(self):
+        with self.app.app_context():
+            return OutboxEmail.query.filter(OutboxEmail.status.in_(('pending', 'sending'))).count()
+
+    def collectors(self):
+        return [self.sent, self.retried, self.failed, self.send_latency]
+
+    def metrics(self):
+        latency_sum, latency_count = self.send_latency.totals()
+        return {
+            'queue_depth': self.queue_depth(),
+            'sent': self.sent.value(),
+            'failed': self.failed.value(),
+            'retried': self.retried.value(),
+            'send_latency_count': latency_count,
+            'send_latency_sum': latency_sum
+        }
+
+
+class Outbox(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['outbox'] = Dispatcher(app)
+
+    @property
+    def dispatcher(self):
+        return current_app.extensions['outbox']
+
+    def enqueue(self, subject, recipients, html):
+        """Add an email to the session, it is sent once the caller commits and calls notify()."""
+        email = OutboxEmail(subject=subject, recipients=','.join(recipients), html=html)
+        db.session.add(email)
+        return email
+
+    def notify(self):
+        self.dispatcher.notify()
+
+
+outbox = Outbox()
@@ -0,0 +1,125 @@
+from flask import current_app
+from sqlalchemy import event, text, or_
+from sqlalchemy.exc import OperationalError
+
+from lreview.extensions import db
+from lreview.models import Post
+
+
+FTS_COLUMNS = ('title', 'body', 'introspection', 'emotion')
+# the trigram tokenizer (SQLite 3.34+) matches substrings, which suits Chinese text
+# that unicode61 cannot split into words; older builds fall back to unicode61
+TOKENIZERS = ('trigram', 'unicode61')
+# column weights for bm25(), the trailing owner column counts for nothing
+BM25 = 'bm25(post_fts, 10.0, 1.0, 1.0, 4.0, 0.0)'
+
+
+def create_index(connection):
+    """Create the FTS5 table if missing, return the tokenizer in use or None without FTS5."""
+    if connection.dialect.name != 'sqlite':
+        return None
+    for tokenizer in TOKENIZERS:
+        try:
+            connection.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5(%s, owner, tokenize='%s')"
+                % (', '.join(FTS_COLUMNS), tokenizer)))
+            return _tokenizer(connection)
+        except OperationalError:
+            continue
+    return None
+
+
+def _tokenizer(connection):
+    sql = connection.execute(text("SELECT sql FROM sqlite_master WHERE type='table' AND name='post_fts'")).scalar()
+    if sql is None or 'owner' not in sql:
+        # missing, or built with an unindexed user_id before; reindex-posts rebuilds it
+        return None
+    return 'trigram' if 'trigram' in sql else 'unicode61'
+
+
+@event.listens_for(Post.__table__, 'after_create')
+def _create_index(target, connection, **kw):
+    create_index(connection)
+
+
+def _owner(user_id):
+    # delimited, so that neither trigrams nor words of one user id match another
+    return 'u%du' % user_id
+
+
+def tokenizer():
+    """Return the tokenizer of the FTS index of the current app, None if there is no index."""
+    if db.engine.dialect.name != 'sqlite':
+        return None
+    state = current_app.extensions.setdefault('lreview_search', {})
+    if state.get('tokenizer') is None:
+        # a missing index is looked up again each time, reindex-posts may have created it since
+        state['tokenizer'] = _tokenizer(db.session.connection())
+    return state['tokenizer']
+
+
+def index_post(post):
+    """Refresh the index row of a post inside the current transaction."""
+    if tokenizer() is None:
+        return
+    db.session.flush()
+    unindex_post(post.id)
+    db.session.execute(text(
+        'INSERT INTO post_fts (rowid, title, body, introspection, emotion, owner) '
+        'VALUES (:id, :title, :body, :introspection, :emotion, :owner)'),
+        {'id': post.id, 'title': post.title, 'body': post.body, 'introspection': post.introspection,
+         'emotion': post.emotion, 'owner': _owner(post.user_id)})
+
+
+def unindex_post(post_id):
+    if tokenizer() is None:
+        return
+    db.session.execute(text('DELETE FROM post_fts WHERE rowid = :id'), {'id': post_id})
+
+
+def reindex():
+    """Rebuild the whole index from the post table, return the number of posts indexed."""
+    connection = db.session.connection()
+    if connection.dialect.name != 'sqlite':
+        return 0
+    connection.execute(text('DROP TABLE IF EXISTS post_fts'))
+    current_app.extensions.setdefault('lreview_search', {})['tokenizer'] = create_index(connection)
+    if tokenizer() is None:
+        return 0
+    connection.execute(text(
+        'INSERT INTO post_fts (rowid, title, body, introspection, emotion, owner) '
+        "SELECT id, title, body, introspection, emotion, 'u' || user_id || 'u' FROM post"))
+    db.session.commit()
+    return Post.query.count()
+
+
+def _terms(q):
+    return [term for term in q.split() if term]
+
+
+def search_posts(user, q, offset, limit):
+    """Return up to limit posts of the user matching every term of q, best match first."""
+    terms = _terms(q)
+    if not terms:
+        return []
+    fts = tokenizer()
+    if fts is None or (fts == 'trigram' and min(len(term) for term in terms) < 3):
+        return _like_search(user, terms, offset, limit)
+
+    # the owner filter is part of the MATCH, so only the posts of the user get ranked
+    match = 'owner : "%s" AND {%s} : (%s)' % (
+        _owner(user.id), ' '.join(FTS_COLUMNS), ' '.join('"%s"' % term.replace('"', '""') for term in terms))
+    ids = [row[0] for row in db.session.execute(text(
+        'SELECT rowid FROM post_fts WHERE post_fts MATCH :match '
+        'ORDER BY %s LIMIT :limit OFFSET :offset' % BM25),
+        {'match': match, 'limit': limit, 'offset': offset})]
+    posts = {post.id: post for post in Post.query.filter(Post.id.in_(ids))} if ids else {}
+    return [posts[post_id] for post_id in ids if post_id in posts]
+
+
+def _like_search(user, terms, offset, limit):
+    query = Post.query.with_parent(user)
+    for term in terms:
+        pattern = '%%%s%%' % term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        query = query.filter(or_(*[getattr(Post, column).like(pattern, escape='\\') for column in FTS_COLUMNS]))
+    return query.order_by(Post.timestamp.desc(), Post.id.desc()).offset(offset).limit(limit).all()
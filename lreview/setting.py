@@ -14,15 +14,102 @@ else:
 class BaseConfig(object):
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev key')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # a replica the read-only views query instead, e.g. a second SQLite file kept in sync
+    SQLALCHEMY_BINDS = {'replica': os.getenv('DATABASE_REPLICA_URL')} if os.getenv('DATABASE_REPLICA_URL') else None
 
-    MAIL_SERVER = 'smtp.gmail.com'
-    MAIL_PORT = 465
-    MAIL_USE_SSL = True
+    # engine tuning, see lreview/database.py; in-memory SQLite keeps its single connection
+    DATABASE_POOL_SIZE = int(os.getenv('DATABASE_POOL_SIZE', 5))
+    DATABASE_MAX_OVERFLOW = int(os.getenv('DATABASE_MAX_OVERFLOW', 10))
+    DATABASE_POOL_RECYCLE = 30 * 60
+    # run on every new SQLite connection; WAL lets readers go on while one writer commits
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,  # negative means KiB, so 64 MiB
+        'busy_timeout': 5000,  # ms a writer waits for the lock before "database is locked"
+    }
+
+    MAIL_SERVER = os.getenv('MAIL_SERVER', 'smtp.gmail.com')
+    MAIL_PORT = int(os.getenv('MAIL_PORT', 465))
+    MAIL_USE_SSL = os.getenv('MAIL_USE_SSL', 'true').lower() == 'true'
     MAIL_USERNAME = os.getenv('MAIL_USERNAME')
     MAIL_PASSWORD = os.getenv('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = ('Lreview', MAIL_USERNAME)
 
+    # outbox dispatcher, see lreview/outbox.py
+    MAIL_OUTBOX_AUTOSTART = True
+    MAIL_OUTBOX_WORKERS = 2
+    MAIL_OUTBOX_BATCH_SIZE = 20
+    MAIL_OUTBOX_POLL_INTERVAL = 30
+    MAIL_OUTBOX_LEASE = 300
+    MAIL_OUTBOX_MAX_ATTEMPTS = 8
+    MAIL_OUTBOX_BACKOFF = 30
+    MAIL_OUTBOX_MAX_BACKOFF = 60 * 60
+
     UPLOADED_PHOTOS_DEST = os.path.join(basedir, 'lreview/static/images')
+    UPLOAD_WORKERS = 4
+
+    # stored images are served from /media, see lreview/media.py
+    MEDIA_MAX_AGE = 60 * 60  # for files not named by their content, e.g. the defaults
+    MEDIA_STAT_CACHE_SIZE = 10000
+    MEDIA_STAT_CACHE_TTL = 60
+    # with nginx, an internal location aliased to UPLOADED_PHOTOS_DEST, e.g. '/protected-images/';
+    # for Apache mod_xsendfile set USE_X_SENDFILE instead
+    MEDIA_ACCEL_REDIRECT_PREFIX = os.getenv('MEDIA_ACCEL_REDIRECT_PREFIX')
+    # ?w= variants, rendered with Pillow when it is installed
+    MEDIA_THUMBNAIL_WIDTHS = (128, 256, 512)
+    MEDIA_THUMBNAIL_WORKERS = 2
+    MEDIA_THUMBNAIL_CACHE_BYTES = 512 * 1024 * 1024
+    MEDIA_PREVIEW_WIDTH = 256  # for covers and list previews in payloads
+
+    # unlinks files of deleted posts and replaced avatars, see lreview/storage.py
+    FILE_REAPER_AUTOSTART = True
+    FILE_REAPER_POLL_INTERVAL = 60
+    FILE_REAPER_BATCH_SIZE = 200
+    FILE_REAPER_GRACE = 60  # seconds before a file that lost a reference may go
+
+    # password hashing runs on a process pool, hashes made with another method are upgraded on login
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:150000'
+    PASSWORD_HASH_WORKERS = os.cpu_count() or 1
+    PASSWORD_HASH_MAX_PENDING = 32
+
+    TOKEN_CACHE_SIZE = 10000
+    TOKEN_CACHE_USER_TTL = 300  # seconds a cached user may lag behind other processes
+
+    # requests over either threshold are logged with their SQL statements
+    METRICS_SLOW_QUERY_COUNT = 20
+    METRICS_SLOW_REQUEST_SECONDS = 1.0
+
+    LREVIEW_POSTS_PER_PAGE = 20
+    LREVIEW_POSTS_MAX_PER_PAGE = 100
+    LREVIEW_STATS_CACHE_SIZE = 10000
+    LREVIEW_STATS_CACHE_TTL = 60 * 60
+    LREVIEW_EXPORT_BATCH_SIZE = 500
+    LREVIEW_IMPORT_BATCH_SIZE = 200
+    LREVIEW_IMPORT_MAX_LINE = 1024 * 1024
+    LREVIEW_IMPORT_MAX_ERRORS = 100
+    LREVIEW_SYNC_TOMBSTONE_DAYS = 90  # see the prune-sync command
+    LREVIEW_BATCH_MAX_REQUESTS = 20
+    # collection bodies smaller than this are sent whole and uncompressed
+    LREVIEW_COMPRESS_MIN_SIZE = 1024
+    LREVIEW_COMPRESS_LEVEL = 6
+
+    # admission control, see lreview/admission.py
+    ADMISSION_ENABLED = True
+    ADMISSION_STORE = os.getenv('ADMISSION_STORE')  # import path of a shared token bucket store
+    ADMISSION_BUCKETS_SIZE = 100000
+    ADMISSION_QUEUE_TIMEOUT = 0  # seconds a request may wait for a concurrency slot
+    # per (endpoint, method): concurrent requests per process, requests per minute per user and per client IP;
+    # behind a proxy, remote_addr is only the client with werkzeug's ProxyFix
+    ADMISSION_LIMITS = {
+        ('api_v1.avatar', 'PUT'): {'concurrency': 4, 'per_user': 10, 'per_ip': 30},
+        ('api_v1.posts', 'POST'): {'concurrency': 8, 'per_user': 30, 'per_ip': 60},
+        ('api_v1.post', 'PUT'): {'concurrency': 8, 'per_user': 30, 'per_ip': 60},
+        ('api_v1.import', 'POST'): {'concurrency': 2, 'per_user': 2, 'per_ip': 4},
+        ('api_v1.token', 'POST'): {'concurrency': PASSWORD_HASH_MAX_PENDING, 'per_ip': 20},
+        ('api_v1.forget', 'POST'): {'concurrency': 4, 'per_ip': 5},
+    }
 
 class DevelopmentConfig(BaseConfig):
     SQLALCHEMY_DATABASE_URI = prefix + os.path.join(basedir, 'data-dev.db')
@@ -33,6 +120,17 @@ class TestingConfig(BaseConfig):
     WTF_CSRF_ENABLED = False
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'  # in-memory database
 
+    # point at a local stand-in, e.g. `python -m aiosmtpd -n -l localhost:8025`
+    MAIL_SERVER = 'localhost'
+    MAIL_PORT = 8025
+    MAIL_SUPPRESS_SEND = False  # Flask-Mail suppresses sending whenever TESTING is set
+    MAIL_USE_SSL = False
+    MAIL_DEFAULT_SENDER = ('Lreview', 'lreview@localhost')
+    MAIL_OUTBOX_AUTOSTART = False
+    FILE_REAPER_AUTOSTART = False
+    PASSWORD_HASH_WORKERS = 0
+    ADMISSION_ENABLED = False
+
 
 class ProductionConfig(BaseConfig):
     SQLALCHEMY_DATABASE_URI = os.getenv(
@@ -0,0 +1,64 @@
+from flask import current_app
+from sqlalchemy import func, extract
+
+from lreview.cache import TTLCache
+from lreview.extensions import db
+from lreview.models import Post
+
+
+def _cache():
+    cache = current_app.extensions.get('lreview_stats')
+    if cache is None:
+        config = current_app.config
+        cache = current_app.extensions['lreview_stats'] = TTLCache(
+            maxsize=config['LREVIEW_STATS_CACHE_SIZE'], ttl=config['LREVIEW_STATS_CACHE_TTL'])
+    return cache
+
+
+def _round(value):
+    return round(float(value), 2) if value is not None else None
+
+
+def compute(user_id, bucket):
+    """Aggregate the posts of a user in SQL."""
+    posts = db.session.query(Post).filter(Post.user_id == user_id)
+
+    count, avg_score, min_score, max_score = posts.with_entities(
+        func.count(Post.id), func.avg(Post.score), func.min(Post.score), func.max(Post.score)).one()
+
+    age_bucket = (Post.happen_age / bucket).label('bucket')
+    ages = posts.with_entities(age_bucket, func.count(Post.id), func.avg(Post.score)).filter(
+        Post.happen_age.isnot(None)).group_by(age_bucket).order_by(age_bucket)
+
+    emotions = posts.with_entities(Post.emotion, func.count(Post.id), func.avg(Post.score)).filter(
+        Post.emotion.isnot(None)).group_by(Post.emotion).order_by(func.count(Post.id).desc())
+
+    year = extract('year', Post.timestamp).label('year')
+    month = extract('month', Post.timestamp).label('month')
+    months = posts.with_entities(year, month, func.count(Post.id), func.avg(Post.score)).filter(
+        Post.timestamp.isnot(None)).group_by(year, month).order_by(year, month)
+
+    return {
+        'posts_count': count,
+        'score': {'avg': _round(avg_score), 'min': min_score, 'max': max_score},
+        'happen_age': [{'from': int(b) * bucket, 'to': int(b) * bucket + bucket - 1, 'count': n, 'avg_score': _round(avg)}
+                       for b, n, avg in ages],
+        'emotions': [{'emotion': emotion, 'count': n, 'avg_score': _round(avg)} for emotion, n, avg in emotions],
+        'monthly': [{'month': '%04d-%02d' % (y, m), 'count': n, 'avg_score': _round(avg)} for y, m, n, avg in months]
+    }
+
+
+def user_stats(user_id, version, bucket):
+    """Return the memoized stats of a user, recomputed when the user version moved."""
+    cache = _cache()
+    cached_version, results = cache.get(user_id, (None, None))
+    if cached_version != version:
+        results = {}
+        cache.set(user_id, (version, results))
+    if bucket not in results:
+        results[bucket] = compute(user_id, bucket)
+    return results[bucket]
+
+
+def invalidate(user):
+    _cache().pop(user.id)
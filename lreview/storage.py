@@ -0,0 +1,283 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from flask import current_app
+from flask_uploads import UploadNotAllowed, extension
+
+from lreview.background import BackgroundWorker
+from lreview import media
+from lreview.extensions import db, photos
+from lreview.metrics import Counter
+from lreview.models import Image, User, FileTombstone
+
+
+CHUNK_SIZE = 64 * 1024
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class StagedFile(object):
+    """An upload written to the staging area, named by the SHA-256 of its content."""
+
+    def __init__(self, path, digest, ext):
+        self.path = path
+        self.digest = digest
+        self.ext = ext
+
+    @property
+    def filename(self):
+        return '%s/%s/%s.%s' % (self.digest[:2], self.digest[2:4], self.digest, self.ext)
+
+
+def _check_allowed(storage):
+    ext = extension(storage.filename).lower()
+    if not photos.extension_allowed(ext):
+        raise UploadNotAllowed()
+    return ext
+
+
+def _staging_dir():
+    staging = os.path.join(photos.config.destination, '.staging')
+    os.makedirs(staging, exist_ok=True)
+    return staging
+
+
+def _write(stream, staging, ext):
+    """Stream an upload to disk in chunks, hashing it on the way."""
+    fd, path = tempfile.mkstemp(dir=staging)
+    sha = hashlib.sha256()
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                sha.update(chunk)
+                f.write(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return StagedFile(path, sha.hexdigest(), ext)
+
+
+def stage(storage):
+    return _write(storage.stream, _staging_dir(), _check_allowed(storage))
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=current_app.config['UPLOAD_WORKERS'])
+        return _pool
+
+
+def stage_all(storages):
+    """Stage several uploads concurrently on a bounded thread pool."""
+    exts = [_check_allowed(storage) for storage in storages]
+    if not storages:
+        return []
+    staging = _staging_dir()
+    futures = [_executor().submit(_write, storage.stream, staging, ext) for storage, ext in zip(storages, exts)]
+    staged = []
+    error = None
+    for future in futures:
+        try:
+            staged.append(future.result())
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        for item in staged:
+            discard(item)
+        raise error
+    return staged
+
+
+def publish(staged):
+    """Move a staged file to its content address, return the stored filename.
+
+    When the same content is already stored the staged copy is dropped, so a
+    duplicate upload costs no extra disk.
+    """
+    path = photos.path(staged.filename)
+    try:
+        # a fresh mtime keeps the reaper off a file that is about to be referenced again
+        os.utime(path, None)
+    except FileNotFoundError:
+        # not stored yet, or reaped since
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(staged.path, path)
+    else:
+        os.remove(staged.path)
+    return staged.filename
+
+
+def discard(staged):
+    try:
+        os.remove(staged.path)
+    except FileNotFoundError:
+        pass
+
+
+@contextmanager
+def committing(staged):
+    """Publish staged files and commit the session when the block exits.
+
+    Yields the stored filenames. If anything fails before the commit goes
+    through, the session is rolled back and the published files are buried,
+    for the reaper to remove once nothing refers to them.
+    """
+    published = []
+    try:
+        for item in staged:
+            published.append(publish(item))
+        yield published
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        for item in staged[len(published):]:
+            discard(item)
+        if published:
+            # not unlinked here: a concurrent upload of the same content may have
+            # published it too and be about to commit a reference, the reaper's
+            # grace period on the file mtime covers that
+            for filename in set(published):
+                bury(filename)
+            try:
+                db.session.commit()
+            except Exception:
+                # the files are left for reconcile-photos
+                db.session.rollback()
+            else:
+                file_reaper.notify()
+        raise
+
+
+def reference_count(filename):
+    return (Image.query.filter_by(filename=filename).count() +
+            User.query.filter_by(avatar=filename).count())
+
+
+def bury(filename):
+    """Record in the current transaction that a file may have lost its last reference."""
+    if filename is not None and not filename.startswith('default/'):
+        db.session.add(FileTombstone(filename=filename))
+
+
+def _recently_touched(path, grace):
+    try:
+        return os.path.getmtime(path) > time.time() - grace
+    except FileNotFoundError:
+        return False
+
+
+class Reaper(BackgroundWorker):
+    """Unlinks buried files once nothing refers to them any more."""
+
+    config_prefix = 'FILE_REAPER'
+    thread_name = 'lreview-file-reaper'
+
+    def __init__(self, app):
+        super(Reaper, self).__init__(app)
+        self.removed = Counter('lreview_files_reaped_total', 'Stored files unlinked by the reaper.')
+
+    def run_once(self):
+        """Process one batch of tombstones, return how many were settled."""
+        grace = self.config('GRACE')
+        tombstones = FileTombstone.query.filter(
+            FileTombstone.timestamp <= datetime.utcnow() - timedelta(seconds=grace)).order_by(
+            FileTombstone.id).limit(self.config('BATCH_SIZE')).all()
+        settled = 0
+        for tombstone in tombstones:
+            path = photos.path(tombstone.filename)
+            if _recently_touched(path, grace):
+                # an upload of the same content is in flight, look again later
+                tombstone.timestamp = datetime.utcnow()
+                continue
+            try:
+                if reference_count(tombstone.filename) == 0 and os.path.exists(path):
+                    if _recently_touched(path, grace):
+                        # published again while the references were counted
+                        tombstone.timestamp = datetime.utcnow()
+                        continue
+                    os.remove(path)
+                    media.forget(tombstone.filename)
+                    self.removed.inc()
+            except OSError:
+                tombstone.attempts += 1
+                continue
+            db.session.delete(tombstone)
+            settled += 1
+        db.session.commit()
+        return settled
+
+    def pending(self):
+        with self.app.app_context():
+            return FileTombstone.query.count()
+
+
+class FileReaper(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['file_reaper'] = Reaper(app)
+
+    def notify(self):
+        current_app.extensions['file_reaper'].notify()
+
+
+def reconcile(batch_size, grace, dry_run=False):
+    """Yield (scanned, orphans) per batch of stored files that no image or avatar refers to."""
+    root = photos.config.destination
+    batch = []
+
+    def settle(batch):
+        names = [name for name, path in batch]
+        referenced = set(name for (name,) in db.session.query(Image.filename).filter(Image.filename.in_(names)))
+        referenced.update(name for (name,) in db.session.query(User.avatar).filter(User.avatar.in_(names)))
+        orphans = [(name, path) for name, path in batch
+                   if name not in referenced and not _recently_touched(path, grace)]
+        if not dry_run:
+            for name, path in orphans:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return len(batch), [name for name, path in orphans]
+
+    staging = os.path.join(root, '.staging')
+    if os.path.isdir(staging) and not dry_run:
+        for filename in os.listdir(staging):
+            path = os.path.join(staging, filename)
+            if not _recently_touched(path, grace):
+                os.remove(path)
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        relative = os.path.relpath(dirpath, root)
+        if relative == '.':
+            # defaults are static assets, the staging area belongs to uploads in flight and
+            # .thumbnails to lreview.thumbnails
+            dirnames[:] = [name for name in dirnames if name != 'default' and not name.startswith('.')]
+        for filename in filenames:
+            if not photos.extension_allowed(extension(filename).lower()):
+                continue
+            path = os.path.join(dirpath, filename)
+            name = filename if relative == '.' else '/'.join(relative.split(os.sep) + [filename])
+            batch.append((name, path))
+            if len(batch) >= batch_size:
+                yield settle(batch)
+                batch = []
+    if batch:
+        yield settle(batch)
+
+
+file_reaper = FileReaper()
@@ -0,0 +1,93 @@
+from sqlalchemy import func, and_, or_
+
+from lreview.extensions import db
+from lreview.models import User, Post, SyncTombstone
+
+
+def delete_post(user, post):
+    """Delete a post, count it out and leave a tombstone for delta sync, inside the current transaction."""
+    user.count_posts(-1)
+    seq = user.next_change()
+    db.session.add(SyncTombstone(kind='Post', object_id=post.id, change_seq=seq, user_id=user.id))
+    db.session.delete(post)
+
+
+def parse_token(value):
+    """Return the (change_seq, post id) position of a sync token, the id is None at change boundaries."""
+    seq, _, post_id = value.partition('.')
+    position = int(seq), int(post_id) if post_id else None
+    if position[0] < 0 or (position[1] is not None and position[1] < 0):
+        raise ValueError(value)
+    return position
+
+
+def format_token(position):
+    seq, post_id = position
+    return str(seq) if post_id is None else '%d.%d' % (seq, post_id)
+
+
+def _posts_after(user, seq, post_id, until, limit):
+    query = Post.query.filter(Post.user_id == user.id, Post.change_seq <= until)
+    if post_id is None:
+        query = query.filter(Post.change_seq > seq)
+    else:
+        query = query.filter(or_(Post.change_seq > seq, and_(Post.change_seq == seq, Post.id > post_id)))
+    return query.order_by(Post.change_seq, Post.id).limit(limit + 1).all()
+
+
+def _tombstones_after(user, seq, until, limit):
+    return SyncTombstone.query.filter(SyncTombstone.user_id == user.id, SyncTombstone.change_seq > seq,
+                                      SyncTombstone.change_seq <= until).order_by(
+        SyncTombstone.change_seq, SyncTombstone.id).limit(limit + 1).all()
+
+
+def changes(user, since, limit):
+    """Return (posts, tombstones, position, has_more) for the changes of a user after since, oldest first.
+
+    since is a position from parse_token(), None means every live post and
+    no tombstones. Pages hold at most limit items in (change_seq, id) order;
+    one that ends inside a change, e.g. the posts of an import batch or the
+    rows predating change sequences, which all share 0, returns a position
+    naming the last post sent.
+    """
+    # every change up to the committed version is visible: the version is
+    # bumped in SQL, so a change holding a lower one has committed already.
+    # Reading it first bounds both queries below to the same set of changes.
+    until = db.session.query(User.version).filter(User.id == user.id).scalar()
+    if since is None:
+        seq, post_id = -1, None
+        posts, tombstones = _posts_after(user, seq, post_id, until, limit), []
+    else:
+        seq, post_id = since
+        posts = _posts_after(user, seq, post_id, until, limit)
+        tombstones = _tombstones_after(user, seq, until, limit)
+    items = sorted(posts + tombstones, key=lambda item: (item.change_seq, isinstance(item, SyncTombstone), item.id))
+    if len(items) <= limit:
+        # caught up to the version read above, which may be ahead of the last post change after profile edits
+        return posts, tombstones, (max(seq, until), None), False
+
+    items = items[:limit]
+    last = items[-1]
+    posts = [item for item in items if isinstance(item, Post)]
+    tombstones = [item for item in items if isinstance(item, SyncTombstone)]
+    # a deletion has a change of its own, so the position after it is a change boundary
+    return posts, tombstones, (last.change_seq, last.id if isinstance(last, Post) else None), True
+
+
+def sync_floor(user):
+    """Read the sync floor from the database, the cached user may predate a prune."""
+    return db.session.query(User.sync_floor).filter(User.id == user.id).scalar() or 0
+
+
+def prune(before):
+    """Drop tombstones older than before and raise the sync floor of their users, return how many went."""
+    floors = db.session.query(SyncTombstone.user_id, func.max(SyncTombstone.change_seq)).filter(
+        SyncTombstone.timestamp < before).group_by(SyncTombstone.user_id).all()
+    removed = 0
+    for user_id, seq in floors:
+        User.query.filter(User.id == user_id, User.sync_floor < seq).update(
+            {'sync_floor': seq}, synchronize_session=False)
+        removed += SyncTombstone.query.filter(SyncTombstone.user_id == user_id,
+                                              SyncTombstone.change_seq <= seq).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
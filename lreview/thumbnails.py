@@ -0,0 +1,162 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from lreview.extensions import photos
+
+try:
+    from PIL import Image as PILImage, ImageOps
+except ImportError:
+    PILImage = None
+
+
+# under the upload destination, so X-Accel-Redirect reaches variants like originals
+THUMBNAIL_DIR = '.thumbnails'
+FORMATS = {'jpg': 'JPEG', 'jpe': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'gif': 'GIF', 'bmp': 'BMP'}
+
+
+def _render(source, path, width):
+    """Write source scaled down to width to path, return the size of the result or None if it cannot be read."""
+    ext = source.rsplit('.', 1)[-1].lower()
+    if ext not in FORMATS:
+        return None
+    try:
+        with PILImage.open(source) as img:
+            # let the JPEG decoder skip detail the variant cannot show
+            img.draft('RGB', (width, width))
+            img = ImageOps.exif_transpose(img)
+            if img.width > width:
+                img = img.resize((width, max(1, round(img.height * width / img.width))), PILImage.LANCZOS)
+            if FORMATS[ext] == 'JPEG' and img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    img.save(f, FORMATS[ext], quality=85)
+                os.replace(tmp, path)
+            except Exception:
+                os.remove(tmp)
+                raise
+    except (OSError, ValueError, PILImage.DecompressionBombError):
+        return None
+    return os.path.getsize(path)
+
+
+class Thumbnails(object):
+    """Width-bounded variants of stored images, rendered on first request and kept within a byte budget.
+
+    The least recently served variants are unlinked first when the budget is
+    exceeded. Requests for a variant that is being rendered wait for that
+    render instead of starting their own.
+    """
+
+    def __init__(self, root, budget, workers):
+        self.root = root
+        self.budget = budget
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self._index = None  # variant name -> size in bytes, least recently served first
+        self._bytes = 0
+        self._inflight = {}
+        self._failed = set()
+
+    def _load(self):
+        """Index the variants already on disk, oldest first."""
+        entries = []
+        top = os.path.join(self.root, THUMBNAIL_DIR)
+        for dirpath, dirnames, filenames in os.walk(top):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                name = os.path.relpath(path, self.root).replace(os.sep, '/')
+                entries.append((stat.st_mtime, name, stat.st_size))
+        self._index = OrderedDict()
+        for mtime, name, size in sorted(entries):
+            self._index[name] = size
+            self._bytes += size
+
+    def _add(self, name, size):
+        self._index[name] = size
+        self._bytes += size
+        while self._bytes > self.budget and len(self._index) > 1:
+            old, old_size = self._index.popitem(last=False)
+            self._bytes -= old_size
+            try:
+                os.remove(os.path.join(self.root, old))
+            except OSError:
+                pass
+
+    def _path(self, name):
+        return os.path.join(self.root, *name.split('/'))
+
+    def get(self, filename, source, width):
+        """Return (name, path, size) of the variant, rendering it if needed, None if source is no image."""
+        name = '%s/%d/%s' % (THUMBNAIL_DIR, width, filename)
+        owner = False
+        with self._lock:
+            if self._index is None:
+                self._load()
+            if name in self._failed:
+                return None
+            size = self._index.get(name)
+            if size is not None:
+                try:
+                    # another process sharing the directory may have evicted it
+                    size = os.stat(self._path(name)).st_size
+                except OSError:
+                    self._bytes -= self._index.pop(name)
+                else:
+                    self._bytes += size - self._index[name]
+                    self._index[name] = size
+                    self._index.move_to_end(name)
+                    return name, self._path(name), size
+            future = self._inflight.get(name)
+            if future is None:
+                future = self._inflight[name] = self._executor.submit(_render, source, self._path(name), width)
+                owner = True
+        try:
+            size = future.result()
+        finally:
+            if owner:
+                with self._lock:
+                    del self._inflight[name]
+                    if future.exception() is None and future.result() is not None:
+                        self._add(name, future.result())
+                    else:
+                        self._failed.add(name)
+        if size is None:
+            return None
+        return name, self._path(name), size
+
+    def discard(self, filename, widths):
+        """Unlink the variants of a file, e.g. after the original went away."""
+        with self._lock:
+            self._failed.difference_update('%s/%d/%s' % (THUMBNAIL_DIR, w, filename) for w in widths)
+            for width in widths:
+                name = '%s/%d/%s' % (THUMBNAIL_DIR, width, filename)
+                if self._index is not None and name in self._index:
+                    self._bytes -= self._index.pop(name)
+                try:
+                    os.remove(self._path(name))
+                except OSError:
+                    pass
+
+
+def thumbnails():
+    """Return the variant cache of the current app, None without Pillow."""
+    if PILImage is None:
+        return None
+    cache = current_app.extensions.get('thumbnails')
+    if cache is None:
+        config = current_app.config
+        cache = current_app.extensions['thumbnails'] = Thumbnails(
+            photos.config.destination, config['MEDIA_THUMBNAIL_CACHE_BYTES'], config['MEDIA_THUMBNAIL_WORKERS'])
+    return cache
@@ -0,0 +1,26 @@
+"""add token generations
+
+Revision ID: 0e8a09cacff3
+Revises: c7ac508d03f2
+Create Date: 2026-10-18 12:37:25.389934
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0e8a09cacff3'
+down_revision = 'c7ac508d03f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('token_generation', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('token_generation')
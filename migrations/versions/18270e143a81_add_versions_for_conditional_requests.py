@@ -0,0 +1,30 @@
+"""add versions for conditional requests
+
+Revision ID: 18270e143a81
+Revises: 80bfa33ba9bd
+Create Date: 2026-10-18 12:37:31.197674
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '18270e143a81'
+down_revision = '80bfa33ba9bd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('user', 'post'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    for table in ('post', 'user'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
+            batch_op.drop_column('version')
@@ -0,0 +1,39 @@
+"""add the post full-text index
+
+Revision ID: 3235514606d7
+Revises: 18270e143a81
+Create Date: 2026-10-18 12:37:33.234151
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3235514606d7'
+down_revision = '18270e143a81'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        # search falls back to LIKE
+        return
+    # rebuilt in the current layout if a database made with create_all has one already
+    op.execute('DROP TABLE IF EXISTS post_fts')
+    # trigram (SQLite 3.34+) matches substrings of Chinese text, older builds get unicode61
+    for tokenizer in ('trigram', 'unicode61'):
+        try:
+            op.execute("CREATE VIRTUAL TABLE post_fts USING fts5("
+                       "title, body, introspection, emotion, owner, tokenize='%s')" % tokenizer)
+        except sa.exc.OperationalError:
+            continue
+        op.execute("INSERT INTO post_fts (rowid, title, body, introspection, emotion, owner) "
+                   "SELECT id, title, body, introspection, emotion, 'u' || user_id || 'u' FROM post")
+        return
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute('DROP TABLE IF EXISTS post_fts')
@@ -0,0 +1,65 @@
+"""create the initial tables
+
+Revision ID: 5339814ae894
+Revises: 
+Create Date: 2026-10-18 12:37:21.586542
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5339814ae894'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # databases made with db.create_all() before there were migrations have these already
+    existing = sa.inspect(op.get_bind()).get_table_names()
+    if 'user' not in existing:
+        op.create_table(
+            'user',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('email', sa.String(length=120), nullable=False),
+            sa.Column('username', sa.String(length=64), nullable=False),
+            sa.Column('password_hash', sa.String(length=128), nullable=False),
+            sa.Column('name', sa.String(length=16), nullable=False),
+            sa.Column('birthday', sa.String(length=10), nullable=False),
+            sa.Column('avatar', sa.String(length=64), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('email'),
+            sa.UniqueConstraint('username')
+        )
+    if 'post' not in existing:
+        op.create_table(
+            'post',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('title', sa.String(length=64), nullable=True),
+            sa.Column('happen_age', sa.Integer(), nullable=True),
+            sa.Column('body', sa.Text(), nullable=True),
+            sa.Column('introspection', sa.Text(), nullable=True),
+            sa.Column('emotion', sa.String(length=64), nullable=True),
+            sa.Column('score', sa.Integer(), nullable=True),
+            sa.Column('timestamp', sa.DateTime(), nullable=True),
+            sa.Column('user_id', sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if 'image' not in existing:
+        op.create_table(
+            'image',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('filename', sa.String(length=64), nullable=True),
+            sa.Column('post_id', sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(['post_id'], ['post.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('image')
+    op.drop_table('post')
+    op.drop_table('user')
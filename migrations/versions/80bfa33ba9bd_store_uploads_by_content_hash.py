@@ -0,0 +1,39 @@
+"""store uploads by content hash
+
+Revision ID: 80bfa33ba9bd
+Revises: 93493e021e26
+Create Date: 2026-10-18 12:37:29.274944
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '80bfa33ba9bd'
+down_revision = '93493e021e26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # content addressed names, ab/cd/<sha256>.<ext>, no longer fit in 64 characters
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.alter_column('avatar', existing_type=sa.String(length=64), type_=sa.String(length=128))
+        batch_op.create_index('ix_user_avatar', ['avatar'], unique=False)
+    with op.batch_alter_table('image') as batch_op:
+        batch_op.alter_column('filename', existing_type=sa.String(length=64), type_=sa.String(length=128))
+        batch_op.create_index('ix_image_filename', ['filename'], unique=False)
+    with op.batch_alter_table('curve_point') as batch_op:
+        batch_op.alter_column('cover', existing_type=sa.String(length=64), type_=sa.String(length=128))
+
+
+def downgrade():
+    with op.batch_alter_table('curve_point') as batch_op:
+        batch_op.alter_column('cover', existing_type=sa.String(length=128), type_=sa.String(length=64))
+    with op.batch_alter_table('image') as batch_op:
+        batch_op.drop_index('ix_image_filename')
+        batch_op.alter_column('filename', existing_type=sa.String(length=128), type_=sa.String(length=64))
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_index('ix_user_avatar')
+        batch_op.alter_column('avatar', existing_type=sa.String(length=128), type_=sa.String(length=64))
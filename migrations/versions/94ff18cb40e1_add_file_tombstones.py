@@ -0,0 +1,33 @@
+"""add file tombstones
+
+Revision ID: 94ff18cb40e1
+Revises: 3235514606d7
+Create Date: 2026-10-18 12:37:35.273555
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '94ff18cb40e1'
+down_revision = '3235514606d7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'file_tombstone',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('filename', sa.String(length=128), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_file_tombstone_timestamp', 'file_tombstone', ['timestamp'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_file_tombstone_timestamp', table_name='file_tombstone')
+    op.drop_table('file_tombstone')
@@ -0,0 +1,67 @@
+"""denormalize post counters and covers
+
+Revision ID: 9771572877fe
+Revises: b8ed65e63850
+Create Date: 2026-10-18 12:37:39.138538
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9771572877fe'
+down_revision = 'b8ed65e63850'
+branch_labels = None
+depends_on = None
+
+
+user = sa.table('user', sa.column('id'), sa.column('posts_count'))
+post = sa.table('post', sa.column('id'), sa.column('user_id'), sa.column('title'), sa.column('happen_age'),
+                sa.column('score'), sa.column('image_count'), sa.column('cover_filename'))
+image = sa.table('image', sa.column('id'), sa.column('filename'), sa.column('post_id'))
+curve_point = sa.table('curve_point', sa.column('title'), sa.column('happen_age'), sa.column('score'),
+                       sa.column('cover'), sa.column('user_id'), sa.column('post_id'))
+
+
+def _of_post(column):
+    return sa.select([column]).where(post.c.id == curve_point.c.post_id).as_scalar()
+
+
+def upgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('posts_count', sa.Integer(), server_default='0', nullable=False))
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.add_column(sa.Column('image_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('cover_filename', sa.String(length=128), nullable=True))
+        batch_op.create_index('ix_post_user_timestamp', ['user_id', 'timestamp', 'id'], unique=False)
+    with op.batch_alter_table('image') as batch_op:
+        batch_op.create_index('ix_image_post_id', ['post_id'], unique=False)
+
+    # the same set-based updates as `flask backfill-counters`, `flask check-counters` verifies them
+    op.execute(user.update().values(
+        posts_count=sa.select([sa.func.count(post.c.id)]).where(post.c.user_id == user.c.id).as_scalar()))
+    op.execute(post.update().values(
+        image_count=sa.select([sa.func.count(image.c.id)]).where(image.c.post_id == post.c.id).as_scalar(),
+        cover_filename=sa.select([image.c.filename]).where(image.c.post_id == post.c.id).order_by(
+            image.c.id).limit(1).as_scalar()))
+
+    # the curve projection, as `flask rebuild-curve` would: refresh the points there are, add the missing
+    op.execute(curve_point.update().values(
+        title=_of_post(post.c.title), happen_age=_of_post(post.c.happen_age), score=_of_post(post.c.score),
+        cover=_of_post(post.c.cover_filename), user_id=_of_post(post.c.user_id)))
+    op.execute(curve_point.insert().from_select(
+        ['title', 'happen_age', 'score', 'cover', 'user_id', 'post_id'],
+        sa.select([post.c.title, post.c.happen_age, post.c.score, post.c.cover_filename, post.c.user_id, post.c.id]).where(
+            ~sa.exists().where(curve_point.c.post_id == post.c.id))))
+
+
+def downgrade():
+    with op.batch_alter_table('image') as batch_op:
+        batch_op.drop_index('ix_image_post_id')
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.drop_index('ix_post_user_timestamp')
+        batch_op.drop_column('cover_filename')
+        batch_op.drop_column('image_count')
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('posts_count')
@@ -0,0 +1,49 @@
+"""add delta sync
+
+Revision ID: b8ed65e63850
+Revises: 94ff18cb40e1
+Create Date: 2026-10-18 12:37:37.273296
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8ed65e63850'
+down_revision = '94ff18cb40e1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('sync_floor', sa.Integer(), server_default='0', nullable=False))
+    # existing posts share change 0, the changes endpoint pages through them by id
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.add_column(sa.Column('change_seq', sa.Integer(), server_default='0', nullable=False))
+        batch_op.create_index('ix_post_user_change_seq', ['user_id', 'change_seq'], unique=False)
+    op.create_table(
+        'sync_tombstone',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=16), nullable=False),
+        sa.Column('object_id', sa.Integer(), nullable=False),
+        sa.Column('change_seq', sa.Integer(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_sync_tombstone_timestamp', 'sync_tombstone', ['timestamp'], unique=False)
+    op.create_index('ix_sync_tombstone_user_change_seq', 'sync_tombstone', ['user_id', 'change_seq'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_sync_tombstone_user_change_seq', table_name='sync_tombstone')
+    op.drop_index('ix_sync_tombstone_timestamp', table_name='sync_tombstone')
+    op.drop_table('sync_tombstone')
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.drop_index('ix_post_user_change_seq')
+        batch_op.drop_column('change_seq')
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('sync_floor')
@@ -0,0 +1,40 @@
+"""add curve points
+
+Revision ID: c7ac508d03f2
+Revises: 5339814ae894
+Create Date: 2026-10-18 12:37:23.439653
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7ac508d03f2'
+down_revision = '5339814ae894'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'curve_point',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(length=64), nullable=True),
+        sa.Column('happen_age', sa.Integer(), nullable=True),
+        sa.Column('score', sa.Integer(), nullable=True),
+        sa.Column('cover', sa.String(length=64), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('post_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['post_id'], ['post.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('post_id')
+    )
+    op.create_index('ix_curve_point_user_post', 'curve_point', ['user_id', 'post_id'], unique=False)
+    # filled from the posts by the last revision of the series, once posts carry their cover
+
+
+def downgrade():
+    op.drop_index('ix_curve_point_user_post', table_name='curve_point')
+    op.drop_table('curve_point')